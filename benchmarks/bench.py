@@ -0,0 +1,419 @@
+"""
+throughput benchmark of thegame environments
+
+  python benchmarks/bench.py --env train env v1 --obv-type gray rgb \\
+      --width 80 160 --stack 1 4 --skip 0 3 --entities 15 60 > result.jsonl
+
+every case of the parameter grid runs in a fresh process with its own
+thegame.cfg, one json line per case is written to stdout:
+  step_ms_median, step_ms_p99, reset_ms_median, reset_ms_p99: latency
+  alloc_kb_per_step: median peak of memory allocated within a step
+  peak_rss_kb: peak resident memory of the env process,
+  peak_rss_children_kb: and of its client processes
+
+server-backed envs run against a stub world standing in for thegame server,
+the thegame client library is still required
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+ENVS = ('train', 'train-vec', 'env', 'v1')
+
+
+class StubWorld:
+  """
+  deterministic random world standing in for thegame server,
+  `entities` entities split into heroes, polygons and bullets
+  """
+  def __init__(self, entities, seed=0):
+    self.random = random.Random(seed)
+    self.n_heroes = entities // 10
+    self.n_bullets = entities // 5
+    self.n_polygons = entities - self.n_heroes - self.n_bullets
+    self.next_id = 0
+    self.reset()
+
+  def entity(self, **attrs):
+    self.next_id += 1
+    return types.SimpleNamespace(id=self.next_id,
+                                 health=attrs.get('max_health', 1000),
+                                 **attrs)
+
+  def around(self, reach=800):
+    x, y = self.hero.position
+    return (x + self.random.uniform(-reach, reach),
+            y + self.random.uniform(-reach, reach))
+
+  def reset(self):
+    rng = self.random
+    self.hero = self.entity(position=(rng.uniform(500, 4500),
+                                      rng.uniform(500, 3500)),
+                            radius=30,
+                            max_health=1000,
+                            body_damage=40,
+                            rewarding_experience=360,
+                            score=0)
+    self.heroes = [
+        self.entity(position=self.around(),
+                    radius=30,
+                    max_health=1000,
+                    body_damage=40,
+                    rewarding_experience=360)
+        for _ in range(self.n_heroes)
+    ]
+    self.polygons = [self.polygon() for _ in range(self.n_polygons)]
+    self.bullets = [self.bullet() for _ in range(self.n_bullets)]
+
+  def polygon(self):
+    edges = self.random.randint(3, 5)
+    return self.entity(position=self.around(),
+                       radius={3: 20, 4: 20, 5: 25}[edges],
+                       max_health={3: 100, 4: 300, 5: 1000}[edges],
+                       edges=edges,
+                       body_damage={3: 10, 4: 20, 5: 40}[edges],
+                       rewarding_experience={3: 10, 4: 60, 5: 360}[edges])
+
+  def bullet(self):
+    owner = self.random.choice([self.hero, *self.heroes])
+    return self.entity(position=owner.position,
+                       radius=10,
+                       max_health=40,
+                       owner_id=owner.id,
+                       body_damage=12,
+                       rewarding_experience=0,
+                       velocity=(self.random.uniform(-30, 30),
+                                 self.random.uniform(-30, 30)))
+
+  def tick(self):
+    """
+    advance one tick, return (hero, heroes, polygons, bullets)
+    """
+    rng = self.random
+    for b in self.bullets:
+      x, y = b.position
+      b.position = x + b.velocity[0], y + b.velocity[1]
+    # some polygons are hit, killed ones respawn
+    for i, p in enumerate(self.polygons):
+      if rng.random() < 0.05:
+        p.health -= 12
+        if p.health <= 0:
+          self.hero.score += p.rewarding_experience
+          self.polygons[i] = self.polygon()
+    # bullets expire
+    for i in range(len(self.bullets)):
+      if rng.random() < 0.02:
+        self.bullets[i] = self.bullet()
+    return self.hero, self.heroes, self.polygons, self.bullets
+
+
+### ThegameEnv: stub server and client ###
+# server ticks handed to the forked client process
+TICKS = None
+
+
+class StubServer:
+  """
+  stands in for `Server`, every synced tick runs one client action
+  """
+  def __init__(self, server='./thegame-server', port=50051):
+    self.running = False
+
+  def start(self):
+    self.running = True
+
+  def alive(self):
+    return self.running
+
+  def wait_ready(self, timeout=10):
+    pass
+
+  def sync(self, ticks=1):
+    for _ in range(ticks):
+      TICKS.release()
+
+  def terminate(self):
+    self.running = False
+
+
+def stub_client(entities):
+  from gym_thegame.envs.client import Client
+
+  class StubClient(Client):
+    """
+    `Client` playing in a `StubWorld` instead of thegame server
+    """
+    def run(self):
+      self.world = StubWorld(entities)
+      while True:
+        TICKS.acquire()
+        self.action(*self.world.tick())
+
+    def accelerate_towards(self, x, y):
+      self.world.hero.position = x, y
+
+    def accelerate(self, direction):
+      pass
+
+    def shoot(self, direction):
+      pass
+
+    def level_up(self, ability_type):
+      pass
+
+  return StubClient
+
+
+### ThegameEnvV1: stub gymbase ###
+def stub_gymbase(entities):
+  """
+  gymbase module whose SinglePlayerEnv plays in a `StubWorld`
+  with the same step sequence as thegame SinglePlayerEnv
+  """
+  import gym
+
+  GameState = namedtuple('GameState', 'hero heroes polygons bullets')
+  Controls = namedtuple(
+      'Controls',
+      'accelerate acceleration_direction shoot shoot_direction')
+
+  class StubGame:
+    def __init__(self):
+      self.world = StubWorld(entities)
+      self.state = GameState(*self.world.tick())
+
+    def reset(self):
+      self.world.reset()
+
+    def tick(self):
+      self.state = GameState(*self.world.tick())
+
+    def send_controls(self, controls):
+      self.controls = controls
+
+    def fetch_state(self):
+      # a new game state object every tick, as fetched by the client
+      return GameState(*self.state)
+
+  class SinglePlayerEnv(gym.Env):
+    def __init__(self, server_bin, listen, total_steps):
+      self.server = self.client = StubGame()
+      self.total_steps = total_steps
+      self.step_num = 0
+
+    def step(self, action):
+      self.client.send_controls(self.action_to_controls(action))
+      self.server.tick()
+      prev, self.game_state = self.game_state, self.client.fetch_state()
+      self.step_num += 1
+      obv = self.game_state_to_observation(self.game_state)
+      reward = self.get_reward(prev, self.game_state)
+      return obv, reward, self.step_num >= self.total_steps, {}
+
+  module = types.ModuleType('thegame.experimental.gymbase')
+  module.GameState, module.Controls = GameState, Controls
+  module.SinglePlayerEnv = SinglePlayerEnv
+  return module
+
+
+def make_env(case):
+  global TICKS
+  if case['env'] == 'train':
+    from gym_thegame.envs import ThegameTrainEnv
+    env = ThegameTrainEnv()
+    env.seed(0)
+    return env
+  if case['env'] == 'train-vec':
+    from gym_thegame.envs import ThegameTrainVecEnv
+    env = ThegameTrainVecEnv(case['num_envs'])
+    env.seed(0)
+    return env
+  if case['env'] == 'env':
+    from gym_thegame.envs import thegame_env
+    TICKS = multiprocessing.Semaphore(0)
+    thegame_env.Server = StubServer
+    thegame_env.Client = stub_client(case['entities'])
+    return thegame_env.ThegameEnv()
+  if case['env'] == 'v1':
+    import thegame.experimental
+    sys.modules['thegame.experimental.gymbase'] = stub_gymbase(
+        case['entities'])
+    from gym_thegame.envs.thegame_env_v1 import ThegameEnvV1
+    return ThegameEnvV1()
+  raise ValueError('unknown env {}'.format(case['env']))
+
+
+def write_cfg(case, path):
+  entities = case['entities']
+  with open(path, 'w') as f:
+    f.write('[Environment]\n')
+    for key, value in (
+        ('ObvType', case['obv_type']),
+        ('ObvDtype', case['obv_dtype']),
+        ('Width', case['width']),
+        ('Height', case['width']),
+        ('StackFrame', case['stack']),
+        ('SkipFrame', case['skip']),
+        ('TotalSteps', 1 << 30),
+        ('PolyGenNum', entities),
+        ('PolyShootableNum', min(7, entities)),
+    ):
+      f.write('{} = {}\n'.format(key, value))
+
+
+def percentiles(samples):
+  samples = np.asarray(samples) * 1e3
+  return float(np.median(samples)), float(np.percentile(samples, 99))
+
+
+def run_case(case):
+  """
+  measure one case in this process
+  """
+  env = make_env(case)
+  if case['env'] == 'train-vec':
+    action = lambda: [env.action_space.sample() for _ in range(env.num_envs)]
+  else:
+    action = env.action_space.sample
+
+  # reset latency
+  resets = []
+  for _ in range(case['resets']):
+    start = time.perf_counter()
+    env.reset()
+    resets.append(time.perf_counter() - start)
+
+  # step latency
+  for _ in range(case['warmup']):
+    env.step(action())
+  steps = []
+  for _ in range(case['steps']):
+    a = action()
+    start = time.perf_counter()
+    env.step(a)
+    steps.append(time.perf_counter() - start)
+
+  # allocations, measured separately since tracing slows down steps
+  tracemalloc.start()
+  allocs = []
+  for _ in range(min(case['steps'], 50)):
+    a = action()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    env.step(a)
+    allocs.append(tracemalloc.get_traced_memory()[1] - current)
+  tracemalloc.stop()
+  env.close()
+
+  step_median, step_p99 = percentiles(steps)
+  reset_median, reset_p99 = percentiles(resets)
+  return {
+      **case,
+      'step_ms_median': step_median,
+      'step_ms_p99': step_p99,
+      'reset_ms_median': reset_median,
+      'reset_ms_p99': reset_p99,
+      'alloc_kb_per_step': float(np.median(allocs)) / 1024,
+      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      'peak_rss_children_kb':
+      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+  }
+
+
+def version():
+  try:
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                            cwd=ROOT,
+                            capture_output=True,
+                            encoding='utf-8').stdout.strip()
+  except OSError:
+    commit = ''
+  return {
+      'commit': commit,
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--env', nargs='+', default=['train', 'env', 'v1'],
+                      choices=ENVS)
+  parser.add_argument('--obv-type', nargs='+', default=['gray', 'rgb',
+                                                        'layer'])
+  parser.add_argument('--obv-dtype', nargs='+', default=['float64'])
+  parser.add_argument('--width', nargs='+', type=int, default=[80, 160])
+  parser.add_argument('--stack', nargs='+', type=int, default=[1, 4])
+  parser.add_argument('--skip', nargs='+', type=int, default=[0, 3])
+  parser.add_argument('--entities', nargs='+', type=int, default=[15, 60])
+  parser.add_argument('--num-envs', type=int, default=8,
+                      help='worlds of train-vec')
+  parser.add_argument('--steps', type=int, default=300)
+  parser.add_argument('--warmup', type=int, default=20)
+  parser.add_argument('--resets', type=int, default=5)
+  parser.add_argument('--case', help=argparse.SUPPRESS)
+  opts = parser.parse_args()
+
+  if opts.case:
+    # child process: run one case in the current directory
+    case = json.loads(opts.case)
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as sys.stdout:
+      result = run_case(case)
+    sys.stdout = stdout
+    print(json.dumps(result), flush=True)
+    return
+
+  meta = version()
+  grid = itertools.product(opts.env, opts.obv_type, opts.obv_dtype,
+                           opts.width, opts.stack, opts.skip, opts.entities)
+  for env, obv_type, obv_dtype, width, stack, skip, entities in grid:
+    if obv_type in ('layer', 'entities') and obv_dtype == 'uint8':
+      continue
+    case = {
+        'env': env,
+        'obv_type': obv_type,
+        'obv_dtype': obv_dtype,
+        'width': width,
+        'stack': stack,
+        'skip': skip,
+        'entities': entities,
+        'num_envs': opts.num_envs if env == 'train-vec' else 1,
+        'steps': opts.steps,
+        'warmup': opts.warmup,
+        'resets': opts.resets,
+    }
+    with tempfile.TemporaryDirectory() as cwd:
+      write_cfg(case, os.path.join(cwd, 'thegame.cfg'))
+      proc = subprocess.run(
+          [sys.executable, os.path.abspath(__file__), '--case',
+           json.dumps(case)],
+          cwd=cwd,
+          stdout=subprocess.PIPE,
+          encoding='utf-8')
+    if proc.returncode:
+      result = {**case, 'error': proc.returncode}
+    else:
+      result = json.loads(proc.stdout.splitlines()[-1])
+    print(json.dumps({**result, **meta}), flush=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,3 +1,26 @@
-from gym_thegame.envs.thegame_env import ThegameEnv
-from gym_thegame.envs.thegame_env_v1 import ThegameEnvV1
-from gym_thegame.envs.thegame_train_env import ThegameTrainEnv
+import importlib
+
+# envs are imported on first access, so that e.g. thegame-train-v0
+# does not import thegame client or gymbase
+_env_modules = {
+    'ThegameEnv': 'gym_thegame.envs.thegame_env',
+    'ThegameEnvV1': 'gym_thegame.envs.thegame_env_v1',
+    'ThegameMultiEnv': 'gym_thegame.envs.thegame_multi_env',
+    'ThegameReplayEnv': 'gym_thegame.envs.thegame_replay_env',
+    'ThegameTrainEnv': 'gym_thegame.envs.thegame_train_env',
+    'ThegameTrainVecEnv': 'gym_thegame.envs.thegame_train_vec_env',
+    'ThegameVecEnv': 'gym_thegame.envs.thegame_vec_env',
+}
+
+__all__ = list(_env_modules)
+
+
+def __getattr__(name):
+  if name in _env_modules:
+    return getattr(importlib.import_module(_env_modules[name]), name)
+  raise AttributeError('module {!r} has no attribute {!r}'.format(
+      __name__, name))
+
+
+def __dir__():
+  return sorted([*globals(), *_env_modules])
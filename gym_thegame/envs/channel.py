@@ -0,0 +1,156 @@
+from gym_thegame.envs.entity import ENTITY_DTYPE, EntityBatch
+import multiprocessing
+import numpy as np
+
+HEADER_DTYPE = np.dtype([
+    # state: entity counts and reward
+    ('n_heroes', np.int64),
+    ('n_polygons', np.int64),
+    ('n_bullets', np.int64),
+    ('reward', np.float64),
+    # actions: nan or -1 for None
+    ('shoot_dir', np.float64),
+    ('acc_dir', np.float64),
+    ('ability_type', np.int64),
+    ('move_to', np.float64, (2, )),
+    ('ticks', np.int64),
+    ('render', np.int64),
+    ('client_time', np.float64, (3, )),
+])
+# phases of `client_time`
+CLIENT_PHASES = ('client_batch', 'client_reward', 'client_render')
+
+
+class StateChannel:
+  """
+  lockstep transport between ThegameEnv and its Client process
+  the client writes entity records, reward and optionally the rendered
+  frame into shared memory, the env writes actions back into the header,
+  each side hands over to the other by releasing a semaphore
+  """
+  def __init__(self, capacity=4096, frame_shape=None, frame_dtype=None):
+    self.capacity = capacity
+    self.shared = multiprocessing.RawArray(
+        'B', HEADER_DTYPE.itemsize + capacity * ENTITY_DTYPE.itemsize)
+    # frame rendered by the client
+    self.frame_shape, self.frame_dtype = frame_shape, np.dtype(frame_dtype)
+    self.shared_frame = None
+    if frame_shape is not None:
+      self.shared_frame = multiprocessing.RawArray(
+          'B', int(np.prod(frame_shape)) * self.frame_dtype.itemsize)
+    self.state_ready = multiprocessing.Semaphore(0)
+    self.actions_ready = multiprocessing.Semaphore(0)
+    self.attach()
+
+  def attach(self):
+    self.header = np.frombuffer(self.shared, HEADER_DTYPE, count=1)
+    self.records = np.frombuffer(self.shared,
+                                 ENTITY_DTYPE,
+                                 count=self.capacity,
+                                 offset=HEADER_DTYPE.itemsize)
+    self.frame = None
+    if self.shared_frame is not None:
+      self.frame = np.frombuffer(self.shared_frame,
+                                 self.frame_dtype).reshape(self.frame_shape)
+
+  def __getstate__(self):
+    return (self.capacity, self.shared, self.frame_shape, self.frame_dtype,
+            self.shared_frame, self.state_ready, self.actions_ready)
+
+  def __setstate__(self, state):
+    (self.capacity, self.shared, self.frame_shape, self.frame_dtype,
+     self.shared_frame, self.state_ready, self.actions_ready) = state
+    self.attach()
+
+  ### client side ###
+  def ready(self):
+    """
+    signal the env that the client process is up
+    """
+    self.state_ready.release()
+
+  def send_state(self, batch, reward, frame=None, stats=None):
+    if len(batch) > self.capacity:
+      raise ValueError('{} entities exceed channel capacity {}'.format(
+          len(batch), self.capacity))
+    batch.to_records(self.records)
+    header = self.header
+    header['n_heroes'] = batch.n_heroes
+    header['n_polygons'] = batch.n_polygons
+    header['n_bullets'] = batch.n_bullets
+    header['reward'] = reward
+    if frame is not None:
+      self.frame[...] = frame
+    if stats is not None:
+      header['client_time'] = [
+          stats['time'].get(phase, 0) for phase in CLIENT_PHASES
+      ]
+    self.state_ready.release()
+
+  def recv_actions(self):
+    """
+    return (shoot_dir, acc_dir, ability_type), move_to, ticks, render
+    """
+    self.actions_ready.acquire()
+    header = self.header[0]
+    shoot_dir, acc_dir = header['shoot_dir'], header['acc_dir']
+    ability_type = header['ability_type']
+    move_to = header['move_to']
+    actions = (None if np.isnan(shoot_dir) else float(shoot_dir),
+               None if np.isnan(acc_dir) else float(acc_dir),
+               None if ability_type < 0 else int(ability_type))
+    move_to = None if np.isnan(move_to[0]) else tuple(move_to.tolist())
+    return actions, move_to, int(header['ticks']), bool(header['render'])
+
+  ### env side ###
+  def wait_ready(self, alive=None):
+    """
+    block until the client process is up, raise once `alive()` is false
+    """
+    while not self.state_ready.acquire(timeout=1):
+      if alive is not None and not alive():
+        raise RuntimeError('thegame client exited before it was ready')
+
+  def send_actions(self, actions, move_to=None, ticks=1, render=False):
+    """
+    `render`: the client renders the frame of the next state
+    """
+    shoot_dir, acc_dir, ability_type = actions or (None, None, None)
+    header = self.header
+    header['shoot_dir'] = np.nan if shoot_dir is None else shoot_dir
+    header['acc_dir'] = np.nan if acc_dir is None else acc_dir
+    header['ability_type'] = -1 if ability_type is None else ability_type
+    header['move_to'] = (np.nan, np.nan) if move_to is None else move_to
+    header['ticks'] = ticks
+    header['render'] = render
+    self.actions_ready.release()
+
+  def recv_state(self, timeout=None):
+    """
+    return (entity batch, reward), or None if timeout
+    """
+    if not self.state_ready.acquire(timeout=timeout):
+      return None
+    header = self.header[0]
+    batch = EntityBatch.from_records(self.records, int(header['n_heroes']),
+                                     int(header['n_polygons']),
+                                     int(header['n_bullets']))
+    return batch, float(header['reward'])
+
+  def wait_state(self, alive):
+    """
+    block until the next state, raise once `alive()` is false
+    return (entity batch, reward)
+    """
+    state = self.recv_state(timeout=1)
+    while state is None:
+      if not alive():
+        raise RuntimeError('thegame exited before the state was received')
+      state = self.recv_state(timeout=1)
+    return state
+
+  def client_time(self):
+    """
+    phase times of the client reporting the last state
+    """
+    return dict(zip(CLIENT_PHASES, self.header[0]['client_time'].tolist()))
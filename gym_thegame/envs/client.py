@@ -1,3 +1,7 @@
+from gym_thegame.envs.entity import EntityBatch
+from gym_thegame.envs.reward import RewardTracker
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.utils import get_to_state_fn
 from thegame import HeadlessClient, Ability
 from gym import logger
 import numpy as np
@@ -8,43 +12,45 @@ import sys
 class Client(HeadlessClient):
   XMax, YMax = 5000, 4000
 
-  def __init__(self, args, *pipes):
+  def __init__(self, args, channel):
     self.name = args.name
     self.args = args
-    self.pipe_actions, self.pipe_obv_reward = pipes
+    self.channel = channel
+    self.to_state_fn = get_to_state_fn[args.obv_type]
+    self.render = False
+    self.stats = make_stats(args.profile)
 
     # environment state preserve
     self.prev_score = 0
-    self.prev_enemies = {}
+    self.rewards = RewardTracker()
+    # reset walk: target and remaining ticks
+    self.walk_to, self.walk_ticks = None, 0
 
   def action(self, hero, heroes, polygons, bullets):
-    # reward calculate
-    def reward_scaling(e_cur, e_prev):
-      health, max_health, exp = e_cur
-      health_prev, _, _ = e_prev
-      if health >= health_prev:
-        return 0
-      discount_factor = (health_prev -
-                         health) / max_health * (1.5 - health / max_health)
-      return exp * discount_factor / 2
+    if self.walk_ticks:
+      # keep walking without reporting state
+      self.walk_ticks -= 1
+      self.accelerate_towards(*self.walk_to)
+      return
 
-    enemies = {}
-    reward = 0
-    for e in [*heroes, *polygons]:
-      enemies[e.id] = (e.health, e.max_health, e.rewarding_experience)
-    for e_id in enemies.keys() & self.prev_enemies.keys():
-      reward += reward_scaling(enemies[e_id], self.prev_enemies[e_id])
+    self.stats.start()
+    batch = EntityBatch.from_state((hero, heroes, polygons, bullets))
+    self.stats.lap('client_batch')
 
+    # reward calculate
+    reward = self.rewards.update(batch)
     reward += (hero.score - self.prev_score) / 2
-
     self.prev_score = hero.score
-    self.prev_enemies = enemies
-    self.pipe_obv_reward.send(((hero, heroes, polygons, bullets), reward))
+    self.stats.lap('client_reward')
+    frame = self.to_state_fn(batch, self.args) if self.render else None
+    self.stats.lap('client_render')
+    self.channel.send_state(batch, reward, frame, self.stats.stop())
 
     # receive actions
-    actions, move_to = self.pipe_actions.recv()
+    actions, move_to, ticks, self.render = self.channel.recv_actions()
 
     if move_to:
+      self.walk_to, self.walk_ticks = move_to, ticks - 1
       self.accelerate_towards(*move_to)
       return
 
@@ -68,4 +74,6 @@ class Client(HeadlessClient):
     self = cls(*args)
     self.options = Option()
     self.options.remote = remote
+    # ready handshake
+    self.channel.ready()
     self.run()
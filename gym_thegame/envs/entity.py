@@ -0,0 +1,171 @@
+import numpy as np
+
+# fixed-layout binary record of one entity
+ENTITY_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('owner', np.int64),
+    ('position', np.float64, (2, )),
+    ('radius', np.float64),
+    ('health', np.float64),
+    ('max_health', np.float64),
+    ('edges', np.int64),
+    ('body_damage', np.float64),
+    ('reward', np.float64),
+    ('velocity', np.float64, (2, )),
+])
+
+
+class EntityBatch:
+  """
+  columnar game state
+  entities are ordered as [hero, *heroes, *polygons, *bullets],
+  each column is an array with one row per entity
+  """
+  __slots__ = ('id', 'owner', 'position', 'radius', 'health', 'max_health',
+               'edges', 'body_damage', 'reward', 'velocity', 'n_heroes',
+               'n_polygons', 'n_bullets')
+
+  def __init__(self, id, owner, position, radius, health, max_health, edges,
+               body_damage, reward, velocity, n_heroes, n_polygons,
+               n_bullets):
+    self.id = id
+    self.owner = owner
+    self.position = position
+    self.radius = radius
+    self.health = health
+    self.max_health = max_health
+    self.edges = edges
+    self.body_damage = body_damage
+    self.reward = reward
+    self.velocity = velocity
+    self.n_heroes = n_heroes
+    self.n_polygons = n_polygons
+    self.n_bullets = n_bullets
+
+  @classmethod
+  def from_state(cls, game_state):
+    """
+    build from a game state tuple (hero, heroes, polygons, bullets),
+    entities without velocity are static
+    """
+    hero, heroes, polygons, bullets = game_state
+    rows = np.array(
+        [(e.id, getattr(e, 'owner_id', -1), *e.position, e.radius, e.health,
+          e.max_health, getattr(e, 'edges', 0), e.body_damage,
+          e.rewarding_experience, *getattr(e, 'velocity', (0, 0)))
+         for e in (hero, *heroes, *polygons, *bullets)],
+        dtype=np.float64)
+    ids = rows[:, :2].astype(np.int64)
+    return cls(ids[:, 0], ids[:, 1], rows[:, 2:4], rows[:, 4], rows[:, 5],
+               rows[:, 6], rows[:, 7].astype(np.int64), rows[:, 8],
+               rows[:, 9], rows[:, 10:12], len(heroes), len(polygons),
+               len(bullets))
+
+  @classmethod
+  def from_records(cls, records, n_heroes, n_polygons, n_bullets):
+    """
+    build from `ENTITY_DTYPE` records, columns are copied
+    """
+    records = records[:1 + n_heroes + n_polygons + n_bullets]
+    return cls(*(records[name].copy() for name in ENTITY_DTYPE.names),
+               n_heroes, n_polygons, n_bullets)
+
+  def to_records(self, records):
+    """
+    write into `ENTITY_DTYPE` records, return the written records
+    """
+    records = records[:len(self)]
+    for name in ENTITY_DTYPE.names:
+      records[name] = getattr(self, name)
+    return records
+
+  def __len__(self):
+    return 1 + self.n_heroes + self.n_polygons + self.n_bullets
+
+  @property
+  def heroes(self):
+    return slice(1, 1 + self.n_heroes)
+
+  @property
+  def polygons(self):
+    return slice(1 + self.n_heroes, 1 + self.n_heroes + self.n_polygons)
+
+  @property
+  def bullets(self):
+    return slice(1 + self.n_heroes + self.n_polygons, len(self))
+
+  @property
+  def enemies(self):
+    """
+    heroes and polygons
+    """
+    return slice(1, 1 + self.n_heroes + self.n_polygons)
+
+
+# role of every entity: hero, heroes, polygons, bullets
+ROLES = np.arange(4)
+
+
+class EntityBatches:
+  """
+  entities of a non-empty list of game states concatenated for batched
+  drawing,
+  the columns of `EntityBatch` plus
+    world: game state index of every entity
+    role: index into `ROLES`
+    first: index of the hero of every game state
+  """
+  def __init__(self, batches):
+    counts = np.array([(1, batch.n_heroes, batch.n_polygons, batch.n_bullets)
+                       for batch in batches],
+                      dtype=np.int64)
+    if len(batches) == 1:
+      # a single batch shares its columns
+      (batch, ) = batches
+      columns = {name: getattr(batch, name) for name in ENTITY_DTYPE.names}
+    else:
+      columns = {
+          name: np.concatenate([getattr(batch, name) for batch in batches])
+          for name in ENTITY_DTYPE.names
+      }
+    self.set_columns(counts, columns)
+
+  @classmethod
+  def from_counts(cls, counts):
+    """
+    empty columns for game states with `counts` rows
+    (1, n_heroes, n_polygons, n_bullets), filled by indexing with `role`
+    """
+    self = cls.__new__(cls)
+    n = counts.sum()
+    self.set_columns(counts, {
+        name: np.zeros((n, *ENTITY_DTYPE[name].shape),
+                       dtype=ENTITY_DTYPE[name].base)
+        for name in ENTITY_DTYPE.names
+    })
+    return self
+
+  @classmethod
+  def of(cls, batches):
+    """
+    `batches` if already concatenated, else concatenate a list of
+    `EntityBatch`
+    """
+    return batches if isinstance(batches, cls) else cls(batches)
+
+  def set_columns(self, counts, columns):
+    _, self.n_heroes, self.n_polygons, self.n_bullets = counts.T
+    if len(counts) == 1:
+      self.first = np.zeros(1, dtype=np.int64)
+      self.role = np.repeat(ROLES, counts[0])
+      self.world = np.zeros(len(self.role), dtype=np.int64)
+    else:
+      sizes = counts.sum(axis=1)
+      self.first = np.cumsum(sizes) - sizes
+      self.world = np.repeat(np.arange(len(counts)), sizes)
+      self.role = np.repeat(np.tile(ROLES, len(counts)), counts.ravel())
+    for name in ENTITY_DTYPE.names:
+      setattr(self, name, columns[name])
+
+  def __len__(self):
+    return len(self.first)
@@ -0,0 +1,302 @@
+from gym_thegame.envs.entity import ENTITY_DTYPE, EntityBatch
+import atexit
+import json
+import os
+import queue
+import tempfile
+import threading
+import numpy as np
+
+# one recorded step, entity records and frame deltas are stored separately
+STEP_DTYPE = np.dtype([
+    ('action', np.float64, (3, )),
+    ('reward', np.float64),
+    ('done', np.bool_),
+    # first state of an episode, recorded by reset
+    ('reset', np.bool_),
+    # frame delta from a zero frame instead of the previous frame
+    ('keyframe', np.bool_),
+    ('n_heroes', np.int64),
+    ('n_polygons', np.int64),
+    ('n_bullets', np.int64),
+    ('entity_start', np.int64),
+    ('frame_start', np.int64),
+    ('frame_count', np.int64),
+])
+
+
+def encode_action(action):
+  """
+  action as 3 floats, NaN for missing entries
+  """
+  encoded = np.full(3, np.nan)
+  if action is not None:
+    action = np.asarray(action, dtype=np.float64).ravel()[:3]
+    encoded[:len(action)] = action
+  return encoded
+
+
+class Recorder:
+  """
+  stream steps into chunks of preallocated memory-mapped .npy files
+    <path>/meta.json
+    <path>/<chunk>-steps.npy     `STEP_DTYPE`
+    <path>/<chunk>-entities.npy  `ENTITY_DTYPE`
+    <path>/<chunk>-frames.npy    (index, value) of changed frame pixels
+  a chunk is closed once any of its files is full and truncated to its rows,
+  every chunk starts with a keyframe so it can be read on its own
+  steps are queued and written by a background thread, its errors are
+  raised by the following `record` or `close`,
+  meta.json lists the chunks with their written steps, it is refreshed
+  when a chunk is opened or closed and at every keyframe,
+  pending steps are flushed at interpreter exit
+  """
+  def __init__(self,
+               path,
+               chunk_steps=4096,
+               entity_capacity=1 << 18,
+               frame_capacity=1 << 22,
+               keyframe_interval=256):
+    self.path = path
+    os.makedirs(path, exist_ok=True)
+    self.chunk_steps = chunk_steps
+    self.entity_capacity = entity_capacity
+    self.frame_capacity = frame_capacity
+    self.keyframe_interval = keyframe_interval
+    self.meta = {'chunks': []}
+    self.chunk = None
+    self.error = None
+    self.steps = queue.Queue(256)
+    self.thread = threading.Thread(target=self.write, daemon=True)
+    self.thread.start()
+    atexit.register(self.close)
+
+  def record(self, action, batch, frame, reward, done, reset=False):
+    """
+    queue one step, the newest rendered `frame` is copied
+    """
+    if len(batch) > self.entity_capacity:
+      raise ValueError('{} entities exceed chunk capacity {}'.format(
+          len(batch), self.entity_capacity))
+    if np.size(frame) > self.frame_capacity:
+      raise ValueError('{} frame values exceed chunk capacity {}'.format(
+          np.size(frame), self.frame_capacity))
+    self.put((encode_action(action), batch, np.array(frame), float(reward),
+              bool(done), reset))
+
+  def close(self):
+    atexit.unregister(self.close)
+    if self.thread.is_alive():
+      self.put(None)
+      self.thread.join()
+    if self.error is not None:
+      raise self.error
+
+  def put(self, item):
+    """
+    queue `item` while the writer thread is running,
+    raise its error once it stopped
+    """
+    while True:
+      if self.error is not None:
+        raise self.error
+      if not self.thread.is_alive():
+        raise RuntimeError('recorder is closed')
+      try:
+        self.steps.put(item, timeout=1)
+        return
+      except queue.Full:
+        pass
+
+  ### writer thread ###
+  def write(self):
+    try:
+      while True:
+        step = self.steps.get()
+        if step is None:
+          break
+        self.write_step(*step)
+      if self.chunk is not None:
+        self.close_chunk()
+    except Exception as e:
+      self.error = e
+
+  def open_chunk(self, frame):
+    name = '{:06d}'.format(len(self.meta['chunks']))
+    path = os.path.join(self.path, name)
+    self.meta.update(frame_shape=frame.shape, frame_dtype=frame.dtype.str)
+    self.frame_dtype = np.dtype([('index', np.int64), ('value', frame.dtype)])
+    self.chunk = {
+        'name': name,
+        'steps': 0,
+        'entities': 0,
+        'frames': 0,
+    }
+    self.meta['chunks'].append(self.chunk)
+    open_memmap = np.lib.format.open_memmap
+    self.step_file = open_memmap(path + '-steps.npy', 'w+', STEP_DTYPE,
+                                 (self.chunk_steps, ))
+    self.entity_file = open_memmap(path + '-entities.npy', 'w+',
+                                   ENTITY_DTYPE, (self.entity_capacity, ))
+    self.frame_file = open_memmap(path + '-frames.npy', 'w+',
+                                  self.frame_dtype, (self.frame_capacity, ))
+    self.prev_frame = None
+    self.write_meta()
+
+  def write_meta(self):
+    """
+    flush the open chunk and replace meta.json with its written counts
+    """
+    if self.chunk is not None:
+      for f in (self.step_file, self.entity_file, self.frame_file):
+        f.flush()
+    path = os.path.join(self.path, 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+      json.dump(self.meta, f)
+    os.replace(path + '.tmp', path)
+
+  def close_chunk(self):
+    self.write_meta()
+    path = os.path.join(self.path, self.chunk['name'])
+    files = (('-steps.npy', self.step_file, self.chunk['steps']),
+             ('-entities.npy', self.entity_file, self.chunk['entities']),
+             ('-frames.npy', self.frame_file, self.chunk['frames']))
+    self.step_file = self.entity_file = self.frame_file = None
+    self.chunk = None
+    for suffix, data, rows in files:
+      with open(path + suffix + '.tmp', 'wb') as f:
+        np.save(f, data[:rows])
+      os.replace(path + suffix + '.tmp', path + suffix)
+
+  def write_step(self, action, batch, frame, reward, done, reset):
+    chunk = self.chunk
+    if chunk is None:
+      self.open_chunk(frame)
+      chunk = self.chunk
+    keyframe = chunk['steps'] % self.keyframe_interval == 0
+    if chunk['steps'] and (
+        chunk['steps'] == self.chunk_steps
+        or chunk['entities'] + len(batch) > self.entity_capacity
+        or chunk['frames'] + frame.size > self.frame_capacity):
+      self.close_chunk()
+      return self.write_step(action, batch, frame, reward, done, reset)
+    if keyframe and chunk['steps']:
+      self.write_meta()
+    prev = np.zeros_like(frame) if keyframe else self.prev_frame
+    (index, ) = np.nonzero((frame != prev).ravel())
+
+    entity_start, frame_start = chunk['entities'], chunk['frames']
+    batch.to_records(self.entity_file[entity_start:])
+    deltas = self.frame_file[frame_start:frame_start + len(index)]
+    deltas['index'] = index
+    deltas['value'] = frame.ravel()[index]
+    self.step_file[chunk['steps']] = (action, reward, done, reset, keyframe,
+                                      batch.n_heroes, batch.n_polygons,
+                                      batch.n_bullets, entity_start,
+                                      frame_start, len(index))
+    chunk['steps'] += 1
+    chunk['entities'] += len(batch)
+    chunk['frames'] += len(index)
+    self.prev_frame = frame
+
+
+def make_recorder(args):
+  """
+  recorder into a new run directory under RecordDir, None if not recording
+  """
+  if not args.record_dir:
+    return None
+  os.makedirs(args.record_dir, exist_ok=True)
+  return Recorder(tempfile.mkdtemp(prefix='run-', dir=args.record_dir))
+
+
+class Trajectory:
+  """
+  random access to the steps of a recorder directory,
+  files are memory-mapped and read on demand
+    trajectory[t] = {'action', 'reward', 'done', 'reset', 'batch', 'frame'}
+  """
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as f:
+      self.meta = json.load(f)
+    self.frame_shape = tuple(self.meta.get('frame_shape', ()))
+    self.frame_dtype = np.dtype(self.meta.get('frame_dtype', 'f8'))
+    self.offsets = np.cumsum([0, *(c['steps'] for c in self.meta['chunks'])])
+    self.files = {}
+
+  def __len__(self):
+    return int(self.offsets[-1])
+
+  def chunk(self, c):
+    if c not in self.files:
+      name = os.path.join(self.path, self.meta['chunks'][c]['name'])
+      self.files[c] = tuple(
+          np.load(name + suffix, mmap_mode='r')
+          for suffix in ('-steps.npy', '-entities.npy', '-frames.npy'))
+    return self.files[c]
+
+  def locate(self, t):
+    if t < 0:
+      t += len(self)
+    if not 0 <= t < len(self):
+      raise IndexError('step {} out of range'.format(t))
+    c = int(np.searchsorted(self.offsets, t, side='right')) - 1
+    return c, t - int(self.offsets[c])
+
+  def record(self, t):
+    """
+    `STEP_DTYPE` record of step `t`
+    """
+    c, i = self.locate(t)
+    return self.chunk(c)[0][i]
+
+  def batch(self, t):
+    """
+    entity batch of step `t`, without rebuilding its frame
+    """
+    c, i = self.locate(t)
+    steps, entities, _ = self.chunk(c)
+    step = steps[i]
+    n_heroes, n_polygons, n_bullets = (int(step['n_heroes']),
+                                       int(step['n_polygons']),
+                                       int(step['n_bullets']))
+    start = int(step['entity_start'])
+    return EntityBatch.from_records(
+        entities[start:start + 1 + n_heroes + n_polygons + n_bullets],
+        n_heroes, n_polygons, n_bullets)
+
+  def resets(self):
+    """
+    reset flags of all steps
+    """
+    return np.concatenate([
+        self.chunk(c)[0]['reset'][:chunk['steps']]
+        for c, chunk in enumerate(self.meta['chunks'])
+    ] or [np.zeros(0, dtype=bool)])
+
+  def __getitem__(self, t):
+    c, i = self.locate(t)
+    step = self.chunk(c)[0][i]
+    return {
+        'action': np.array(step['action']),
+        'reward': float(step['reward']),
+        'done': bool(step['done']),
+        'reset': bool(step['reset']),
+        'batch': self.batch(t),
+        'frame': self.frame(c, i),
+    }
+
+  def frame(self, c, i):
+    """
+    apply frame deltas from the last keyframe up to step `i` of chunk `c`
+    """
+    steps, _, frames = self.chunk(c)
+    (keyframes, ) = np.nonzero(steps['keyframe'][:i + 1])
+    frame = np.zeros(self.frame_shape, self.frame_dtype)
+    flat = frame.reshape(-1)
+    for step in steps[keyframes[-1]:i + 1]:
+      start = step['frame_start']
+      deltas = frames[start:start + step['frame_count']]
+      flat[deltas['index']] = deltas['value']
+    return frame
@@ -0,0 +1,91 @@
+import numpy as np
+
+# cached disk stencils: radius -> (dy, dx, dy**2 + dx**2) pixel offsets
+_stencils = {}
+# paints of up to this many disks * largest stencil pixels use one stencil,
+# larger paints loop over the distinct radii instead
+SMALL_PAINT = 2048
+
+
+def disk_stencil(radius):
+  """
+  pixel offsets (dy, dx) covered by a disk of integer `radius`
+  and their squared distances to the center
+  """
+  stencil = _stencils.get(radius)
+  if stencil is None:
+    r = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(r, r, indexing='ij')
+    d2 = dx**2 + dy**2
+    inside = d2 <= radius**2
+    stencil = _stencils[radius] = dy[inside], dx[inside], d2[inside]
+  return stencil
+
+
+def quantize_radius(radius, args):
+  """
+  quantize entity radius into pixels
+  radius / quantize: 0.5 -> 0, 1 -> 1, 1.25 -> 2, 1.5 -> 2, otherwise ceil
+  """
+  radius = np.asarray(radius, dtype=np.float64) / args.quantize
+  return np.where(radius == 0.5, 0, np.ceil(radius)).astype(np.int64)
+
+
+def project(position, hero_position, args):
+  """
+  project world `position` (n, 2) into pixel centers relative to hero,
+  `hero_position` is (2, ) or the hero of every entity (n, 2)
+  """
+  position = np.asarray(position, dtype=np.float64).reshape(-1, 2)
+  hero_position = np.asarray(hero_position, dtype=np.float64)
+  # both axes at once, in the order of the scalar formula
+  xy = np.round(position / args.quantize +
+                (args.width / 2, args.height / 2) -
+                hero_position / args.quantize).astype(np.int64)
+  return xy[:, 0], xy[:, 1]
+
+
+def paint(canvas, x, y, radius, values, args, world=None):
+  """
+  paint disks centered at pixels (`x`, `y`) with `values` (n, channels)
+  into `canvas` (height, width, channels) in order,
+  later entities overwrite earlier ones on overlapping pixels
+  world: canvas index of every disk, `canvas` is then
+    (n_canvas, height, width, channels)
+  """
+  n = len(x)
+  if n == 0:
+    return canvas
+  if world is not None and len(canvas) == 1:
+    paint(canvas[0], x, y, radius, values, args)
+    return canvas
+  dy, dx, d2 = disk_stencil(int(radius.max()))
+  if n * len(d2) <= SMALL_PAINT:
+    # the largest stencil for every disk, cut to its radius
+    k, i = np.nonzero(d2 <= (radius * radius)[:, None])
+    py, px = y[k] + dy[i], x[k] + dx[i]
+  else:
+    pys, pxs, ks = [], [], []
+    for r in np.unique(radius):
+      (k, ), (dy, dx, _) = np.nonzero(radius == r), disk_stencil(int(r))
+      pys.append((y[k, None] + dy).ravel())
+      pxs.append((x[k, None] + dx).ravel())
+      ks.append(np.repeat(k, len(dy)))
+    py, px, k = np.concatenate(pys), np.concatenate(pxs), np.concatenate(ks)
+  inside = (0 <= px) & (px < args.width) & (0 <= py) & (py < args.height)
+  pixel = py[inside] * args.width + px[inside]
+  k = k[inside]
+  if world is not None:
+    # pixels of all canvases are numbered consecutively
+    pixel += world[k] * (args.height * args.width)
+  # keep only the last painted entity of every pixel
+  pixel, k = np.divmod(np.sort(pixel * n + k), n)
+  last = np.append(pixel[1:] != pixel[:-1], True)
+  pixel, values = pixel[last], values[k[last]]
+  flat = canvas.reshape(-1, canvas.shape[-1])
+  if np.may_share_memory(flat, canvas):
+    flat[pixel] = values
+  else:
+    # a canvas whose pixels can not be viewed flat
+    canvas[np.unravel_index(pixel, canvas.shape[:-1])] = values
+  return canvas
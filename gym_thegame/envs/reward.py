@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class RewardTracker:
+  """
+  damage reward of enemies (heroes and polygons) between two ticks
+  health of the previous tick is kept sorted by entity id and looked up
+  by binary search, so any ids are accepted and memory stays bounded
+  by the entities of one tick
+  """
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.sorted_ids = np.zeros(0, dtype=np.int64)
+    self.sorted_health = np.zeros(0)
+
+  def previous_health(self, ids):
+    """
+    health of sorted unique `ids` in the previous tick,
+    NaN for absent entities
+    """
+    prev = np.full(len(ids), np.nan)
+    if len(self.sorted_ids):
+      pos = np.searchsorted(self.sorted_ids, ids).clip(
+          max=len(self.sorted_ids) - 1)
+      (found, ) = np.nonzero(self.sorted_ids[pos] == ids)
+      prev[found] = self.sorted_health[pos[found]]
+    return prev
+
+  def update(self, batch):
+    """
+    reward of enemies damaged since the previous batch, each scaled by
+      exp * (health_prev - health) / max_health * (1.5 - health / max_health) / 2
+    rewards are summed pairwise by np.sum, so the total can differ in the
+    last bits from summing them one by one in entity order
+    """
+    s = batch.enemies
+    ids = batch.id[s]
+
+    # enemies sorted by id, the last of duplicated ids counts
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    last = np.append(ids[1:] != ids[:-1], True)
+    order, ids = order[last], ids[last]
+    health = batch.health[s][order]
+
+    # enemies present in both ticks with health decreased
+    prev = self.previous_health(ids)
+    (damaged, ) = np.nonzero(health < prev)
+    h, h_prev = health[damaged], prev[damaged]
+    max_health = batch.max_health[s][order[damaged]]
+    exp = batch.reward[s][order[damaged]]
+    rewards = exp * ((h_prev - h) / max_health * (1.5 - h / max_health)) / 2
+
+    self.sorted_ids, self.sorted_health = ids, health
+    return float(np.sum(rewards))
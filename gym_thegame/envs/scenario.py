@@ -0,0 +1,212 @@
+import math
+import queue
+import threading
+import numpy as np
+
+
+def generate_scenario(rng, args, first_dir=None):
+  """
+  generate a random hero position and polygons around it
+  rng: `numpy.random.Generator`
+  first_dir: index of the first polygons generating direction
+  return hero position (2, ), thetas (poly_dirs, ),
+    polygon positions (n, 2), polygon edges (n, )
+  """
+  # random init hero position
+  hero = np.array(
+      [rng.integers(300, 4700, endpoint=True),
+       rng.integers(300, 3700, endpoint=True)],
+      dtype=np.float64)
+
+  ### polygons generating directions ###
+  # poly_gen_dirs: all possible generating directions number
+  # poly_dirs:     number of directions polygons be genrated per episode
+  if args.poly_gen_dirs == -1:
+    # uniform random
+    thetas = rng.uniform(0, 2 * math.pi, args.poly_dirs)
+  else:
+    # uniform random for lefting poly_dirs
+    dirs = np.concatenate([[first_dir],
+                           rng.integers(0, args.poly_gen_dirs,
+                                        args.poly_dirs - 1)])
+    thetas = dirs / args.poly_gen_dirs * 2 * math.pi
+
+  # generate polygons using polygons generating directions
+  # the first poly_shootable_num are must shootable for poly_gen_range >= 120
+  shape = args.poly_dirs, args.poly_gen_num
+  spread = np.where(
+      np.arange(args.poly_gen_num) < args.poly_shootable_num,
+      2 * math.pi / 120 / 2, 2 * math.pi / args.poly_gen_range / 2)
+  theta = thetas[:, None] + rng.uniform(-1, 1, shape) * spread
+  R = rng.uniform(100, 800, shape)
+  edges = rng.integers(3, 5, shape, endpoint=True)
+  x, y = hero[0] + np.cos(theta) * R, hero[1] + np.sin(theta) * R
+  inside = (0 < x) & (x < 5000) & (0 < y) & (y < 4000)
+  positions = np.stack([x[inside], y[inside]], axis=-1)
+  return hero, thetas, positions, edges[inside]
+
+
+class ScenarioGenerator:
+  """
+  seeded scenarios, the first generating direction of the k-th scenario
+  is (k * multiply) % poly_gen_dirs
+  """
+  def __init__(self, args, seed=None):
+    self.args = args
+    self.rng = np.random.default_rng(seed)
+    self.counter = 0
+    # reset jump angle: (counter * multiply) % gen_directions
+    self.multiply = None
+    for m in range(args.poly_gen_dirs // 4, args.poly_gen_dirs):
+      if math.gcd(m, args.poly_gen_dirs) == 1:
+        self.multiply = m
+        break
+
+  def next(self):
+    first_dir = None
+    if self.args.poly_gen_dirs != -1:
+      first_dir = self.counter * self.multiply % self.args.poly_gen_dirs
+      self.counter += 1
+    return generate_scenario(self.rng, self.args, first_dir)
+
+  def max_polygons(self):
+    return self.args.poly_dirs * self.args.poly_gen_num
+
+  def get_state(self):
+    return self.counter, self.rng.bit_generator.state
+
+  def set_state(self, state):
+    self.counter, self.rng.bit_generator.state = state
+
+  def clone(self):
+    generator = ScenarioGenerator(self.args)
+    generator.set_state(self.get_state())
+    return generator
+
+  def close(self):
+    pass
+
+
+class ScenarioPool:
+  """
+  scenarios of `generator` pre-generated by a background thread,
+  in the same order as the generator produces them
+  """
+  def __init__(self, generator, size):
+    self.generator, self.size = generator, size
+    self.start()
+
+  def start(self):
+    # generator state after the last scenario taken from the pool
+    self.state = self.generator.get_state()
+    self.pool = queue.Queue(self.size)
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.produce,
+                                   args=(self.pool, self.stopped),
+                                   daemon=True)
+    self.thread.start()
+
+  def produce(self, pool, stopped):
+    while not stopped.is_set():
+      item = self.generator.next(), self.generator.get_state()
+      while not stopped.is_set():
+        try:
+          pool.put(item, timeout=0.1)
+          break
+        except queue.Full:
+          pass
+
+  def next(self):
+    scenario, self.state = self.pool.get()
+    return scenario
+
+  def max_polygons(self):
+    return self.generator.max_polygons()
+
+  def get_state(self):
+    return self.state
+
+  def set_state(self, state):
+    self.close()
+    self.generator.set_state(state)
+    self.start()
+
+  def clone(self):
+    generator = self.generator.clone()
+    generator.set_state(self.state)
+    return ScenarioPool(generator, self.size)
+
+  def close(self):
+    self.stopped.set()
+    self.thread.join()
+
+
+class ScenarioSet:
+  """
+  fixed scenarios, e.g. an evaluation set loaded by `load_scenarios`,
+  used in order and repeated
+  """
+  def __init__(self, scenarios):
+    self.scenarios = scenarios
+    self.index = 0
+
+  def next(self):
+    scenario = self.scenarios[self.index]
+    self.index = (self.index + 1) % len(self.scenarios)
+    return scenario
+
+  def max_polygons(self):
+    return max(len(edges) for _, _, _, edges in self.scenarios)
+
+  def get_state(self):
+    return self.index
+
+  def set_state(self, state):
+    self.index = state
+
+  def clone(self):
+    scenarios = ScenarioSet(self.scenarios)
+    scenarios.set_state(self.index)
+    return scenarios
+
+  def close(self):
+    pass
+
+
+def save_scenarios(path, scenarios):
+  """
+  save scenarios into a .npz file,
+  polygons of all scenarios are concatenated
+  """
+  heroes, thetas, positions, edges = zip(*scenarios)
+  np.savez(path,
+           hero=np.stack(heroes),
+           thetas=np.stack(thetas),
+           offsets=np.cumsum([0, *map(len, edges)]),
+           position=np.concatenate(positions),
+           edges=np.concatenate(edges).astype(np.int8))
+
+
+def load_scenarios(path):
+  with np.load(path) as f:
+    hero, thetas, offsets = f['hero'], f['thetas'], f['offsets']
+    position, edges = f['position'], f['edges'].astype(np.int64)
+  return [(hero[i], thetas[i], position[start:stop], edges[start:stop])
+          for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:]))]
+
+
+def make_scenarios(args, seed=None, offset=0):
+  """
+  scenario source by config:
+    ScenarioFile: fixed scenarios saved by `save_scenarios`
+    ScenarioPool: pool size of background generated scenarios
+  offset: index of the first fixed scenario
+  """
+  if args.scenario_file:
+    scenarios = ScenarioSet(load_scenarios(args.scenario_file))
+    scenarios.set_state(offset % len(scenarios.scenarios))
+    return scenarios
+  generator = ScenarioGenerator(args, seed)
+  if args.scenario_pool > 0:
+    return ScenarioPool(generator, args.scenario_pool)
+  return generator
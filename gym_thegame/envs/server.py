@@ -1,8 +1,25 @@
+import socket
 import subprocess
+import time
+
+
+def free_ports(n):
+  """
+  allocate `n` distinct free tcp ports
+  """
+  socks = [socket.socket() for _ in range(n)]
+  try:
+    for sock in socks:
+      sock.bind(('', 0))
+    return [sock.getsockname()[1] for sock in socks]
+  finally:
+    for sock in socks:
+      sock.close()
 
 
 class Server:
   def __init__(self, server='./thegame-server', port=50051):
+    self.port = port
     self.cmd = [server, '-listen', ':{}'.format(port)]
 
   def start(self):
@@ -10,6 +27,23 @@ class Server:
                                  stdin=subprocess.PIPE,
                                  encoding='utf-8')
 
+  def alive(self):
+    return self.proc.poll() is None
+
+  def wait_ready(self, timeout=10):
+    """
+    block until the server accepts connections
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      try:
+        socket.create_connection(('localhost', self.port), timeout=1).close()
+        return
+      except OSError:
+        if not self.alive() or time.monotonic() > deadline:
+          raise RuntimeError('thegame server is not ready')
+        time.sleep(0.01)
+
   def _send(self, cmd):
     self.proc.stdin.write(cmd)
     self.proc.stdin.flush()
@@ -20,8 +54,9 @@ class Server:
   def resume(self):
     self._send('r\n')
 
-  def sync(self):
-    self._send('s\n')
+  def sync(self, ticks=1):
+    self._send('s\n' * ticks)
 
   def terminate(self):
     self.proc.kill()
+    self.proc.wait()
@@ -0,0 +1,104 @@
+from collections import defaultdict
+import time
+
+
+class Stats:
+  """
+  per-phase monotonic timers and counters of env steps and resets
+    stats.start()
+    ...                         # phase work
+    stats.lap('render')         # time since start or the last lap
+    stats.count('ticks', n)
+    info = stats.stop('step')   # {'time': {...}, 'count': {...}} of the call
+  a call started within another call, e.g. steps within a reset,
+  is accounted in the outer call
+  """
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.calls = defaultdict(int)
+    self.times = defaultdict(lambda: defaultdict(float))
+    self.counts = defaultdict(lambda: defaultdict(int))
+    self.time, self.counter, self.last = {}, {}, None
+    self.depth = 0
+
+  def start(self):
+    if not self.depth:
+      self.time, self.counter = {}, {}
+      self.last = time.perf_counter()
+    self.depth += 1
+
+  def lap(self, phase):
+    now = time.perf_counter()
+    self.time[phase] = self.time.get(phase, 0) + now - self.last
+    self.last = now
+
+  def add(self, times):
+    """
+    add phase times measured elsewhere, e.g. in the client process
+    """
+    for phase, seconds in times.items():
+      self.time[phase] = self.time.get(phase, 0) + seconds
+
+  def count(self, name, n=1):
+    self.counter[name] = self.counter.get(name, 0) + n
+
+  def stop(self, kind='step'):
+    self.depth -= 1
+    if self.depth:
+      return None
+    self.calls[kind] += 1
+    for phase, seconds in self.time.items():
+      self.times[kind][phase] += seconds
+    for name, n in self.counter.items():
+      self.counts[kind][name] += n
+    return {'time': self.time, 'count': self.counter}
+
+  def summary(self):
+    """
+    aggregate stats by kind:
+      {kind: {'calls': n, 'time': {phase: total seconds},
+              'mean': {phase: seconds per call}, 'count': {name: total}}}
+    """
+    return {
+        kind: {
+            'calls': calls,
+            'time': dict(self.times[kind]),
+            'mean':
+            {phase: t / calls
+             for phase, t in self.times[kind].items()},
+            'count': dict(self.counts[kind]),
+        }
+        for kind, calls in self.calls.items()
+    }
+
+
+class NullStats:
+  """
+  disabled stats, every call is a no-op
+  """
+  def clear(self):
+    pass
+
+  def start(self):
+    pass
+
+  def lap(self, phase):
+    pass
+
+  def add(self, times):
+    pass
+
+  def count(self, name, n=1):
+    pass
+
+  def stop(self, kind='step'):
+    return None
+
+  def summary(self):
+    return {}
+
+
+def make_stats(enabled):
+  return Stats() if enabled else NullStats()
@@ -1,13 +1,16 @@
 from gym_thegame.envs.server import Server
 from gym_thegame.envs.client import Client
-from gym_thegame.envs.utils import (LazyFrames, parse_args, get_obs_space,
-                                    get_to_state_fn, convert_to_radians)
+from gym_thegame.envs.channel import StateChannel
+from gym_thegame.envs.recorder import make_recorder
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_state_fn, get_frame_shape,
+                                    state_to_img,
+                                    convert_to_radians)
 import gym
 from gym import logger, spaces
-from collections import deque
 import math
 import multiprocessing
-from time import sleep
 import numpy as np
 
 
@@ -16,12 +19,17 @@ class ThegameEnv(gym.Env):
   """
   metadata = {'render.modes': ['human', 'rgb_array']}
 
-  def __init__(self):
+  def __init__(self, port=None):
     self.args = parse_args()
+    if port is not None:
+      self.args.port = port
     self.viewer = None
     self.server, self.client = None, None
+    self.batch = None
+    self.stats = make_stats(self.args.profile)
+    self.recorder = make_recorder(self.args)
     # observation
-    self.obv = deque([], maxlen=self.args.total_frame)
+    self.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
     self.to_state_fn = get_to_state_fn[self.args.obv_type]
     # observation space
     self.observation_space = get_obs_space(self.args)
@@ -40,12 +48,19 @@ class ThegameEnv(gym.Env):
     def rescale(reward):
       return np.clip(reward / 40, -10, 10)
 
+    self.stats.start()
+    action = actions
     actions = convert_to_radians(actions, self.args)
-
-    self.pipe_actions[0].send((actions, move_to))
-    self.server.sync()
-    game_state, reward = self.pipe_obv_reward[1].recv()
-    obv, self.img = self.to_state_fn(game_state, self.args)
+    batch, reward = self.tick(actions, move_to, render=self.args.client_render)
+    self.batch = batch
+    # the first frame after reset fills the whole stack
+    if self.args.client_render:
+      # rendered by the client into shared memory
+      self.obv.append(self.channel.frame)
+    else:
+      self.obv.append(self.to_state_fn(batch, self.args))
+    self.stats.lap('render')
+    self.stats.count('entities', len(batch))
 
     # update environment timestep and check episode end
     if move_to == None:
@@ -53,56 +68,123 @@ class ThegameEnv(gym.Env):
     done = self.counter >= self.args.total_steps
     if reward != 0:
       print('timestep', self.counter, 'reward', reward)
-    self.obv.append(obv)
-    obv = [
-        self.obv[i]
-        for i in range(0, self.args.total_frame, self.args.skip_frame)
-    ]
-    return LazyFrames(obv), rescale(reward), done, {}
+    obv = self.obv.copy()
+    self.stats.lap('stack')
+    if self.recorder is not None and move_to is None:
+      self.recorder.record(action, batch, self.obv.last(), rescale(reward),
+                           done)
+    info = {}
+    stats = self.stats.stop()
+    if stats is not None:
+      info['stats'] = stats
+    return obv, rescale(reward), done, info
+
+  def tick(self, actions=None, move_to=None, ticks=1, render=False):
+    """
+    advance the game by `ticks` server ticks,
+    the hero keeps moving to `move_to` on every tick
+    render: the client renders the last tick into `channel.frame`
+    return (entity batch, reward) of the last tick
+    """
+    self.channel.send_actions(actions, move_to, ticks, render)
+    self.server.sync(ticks)
+    self.stats.lap('sync')
+    self.stats.count('ticks', ticks)
+    state = self.channel.wait_state(self.alive)
+    # waiting for the client includes the client phases
+    self.stats.lap('wait')
+    if self.args.profile:
+      self.stats.add(self.channel.client_time())
+    return state
+
+  def alive(self):
+    """
+    check if both thegame server and client are running
+    """
+    return (self.server is not None and self.server.alive()
+            and self.client.is_alive())
 
-  def reset(self):
-    # terminate server and client if exist
-    if self.client:
-      self.client.terminate()
-    if self.server:
-      self.server.terminate()
+  def start(self):
+    """
+    (re)start thegame server and client, return once the client is playing
+    """
+    self.terminate()
 
     # create thegame server
     self.server = Server(self.args.server_bin, self.args.port)
     self.server.start()
-    sleep(0.5)
+    self.server.wait_ready()
 
     # create thegame client
-    self.pipe_obv_reward = multiprocessing.Pipe()
-    self.pipe_actions = multiprocessing.Pipe()
+    if self.args.client_render:
+      self.channel = StateChannel(frame_shape=get_frame_shape(self.args),
+                                  frame_dtype=self.args.obv_dtype)
+    else:
+      self.channel = StateChannel()
     self.client = multiprocessing.Process(target=Client.main,
                                           args=(
                                               'localhost:{}'.format(
                                                   self.args.port),
                                               self.args,
-                                              self.pipe_actions[1],
-                                              self.pipe_obv_reward[0],
+                                              self.channel,
                                           ))
     self.client.start()
-    sleep(0.5)
+    self.channel.wait_ready(self.client.is_alive)
 
-    # receive initial observation
+    # tick until the client is connected and receives the first state
     self.server.sync()
-    game_state, _ = self.pipe_obv_reward[1].recv()
-    obv, self.img = self.to_state_fn(game_state, self.args)
-    for _ in range(self.args.total_frame):
-      self.obv.append(obv)
+    while self.channel.recv_state(timeout=1) is None:
+      if not self.alive():
+        raise RuntimeError('thegame exited before the client was playing')
+      self.server.sync()
+
+  def terminate(self):
+    """
+    terminate server and client if exist
+    """
+    if self.client:
+      self.client.terminate()
+      self.client.join()
+    if self.server:
+      self.server.terminate()
+    self.server, self.client = None, None
+
+  def reset(self):
+    self.stats.start()
+    # with KeepAlive server and client are kept across episodes,
+    # restart only if died, the server has no command to reset its arena
+    if not (self.args.keep_alive and self.alive()):
+      self.start()
+      self.stats.lap('start')
+      self.stats.count('restarts')
+    self.obv.clear()
 
     # random init
     self.counter = 0
     random_x, random_y = np.random.random_sample([2]) * 3000 + 500
-    for _ in range(300):
+    # only the last walking frames are kept in the frame buffer
+    walk = 301 - self.args.total_frame
+    while walk > 0:
+      ticks = min(walk, self.args.warm_start_batch)
+      self.tick(move_to=(random_x, random_y), ticks=ticks)
+      walk -= ticks
+    for _ in range(min(301, self.args.total_frame) - 1):
       self.step(move_to=(random_x, random_y))
 
-    return self.step(move_to=(random_x, random_y))[0]
+    obv = self.step(move_to=(random_x, random_y))[0]
+    if self.recorder is not None:
+      self.recorder.record(None, self.batch, self.obv.last(), 0, False, True)
+    self.stats.stop('reset')
+    return obv
+
+  def get_stats(self):
+    """
+    aggregate step and reset stats, empty if Profile is disabled
+    """
+    return self.stats.summary()
 
   def render(self, mode='human'):
-    img = self.img
+    img = state_to_img(self.batch, self.args)
     if mode == 'rgb_array':
       return img
     elif mode == 'human':
@@ -116,7 +198,7 @@ class ThegameEnv(gym.Env):
   def close(self):
     if self.viewer:
       self.viewer.close()
-    if self.client:
-      self.client.terminate()
-    if self.server:
-      self.server.terminate()
+    self.terminate()
+    if self.recorder is not None:
+      self.recorder.close()
+      self.recorder = None
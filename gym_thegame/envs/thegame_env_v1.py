@@ -1,8 +1,13 @@
-from gym_thegame.envs.utils import (LazyFrames, parse_args, get_obs_space,
-                                    get_to_state_fn, convert_to_radians)
+from gym_thegame.envs.entity import EntityBatch
+from gym_thegame.envs.recorder import make_recorder
+from gym_thegame.envs.reward import RewardTracker
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_state_fn, state_to_img,
+                                    convert_to_radians)
 from thegame.experimental.gymbase import SinglePlayerEnv, GameState, Controls
 from gym import logger, spaces
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import math
 import numpy as np
 
@@ -17,9 +22,15 @@ class ThegameEnvV1(SinglePlayerEnv):
     )
     self.viewer = None
     # preserve environment state
-    self.prev_enemies = {}
+    self.rewards = RewardTracker()
+    self.batch_state, self.batch = None, None
+    # background step: controls, server tick, fetch state, render and reward
+    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.pending = None
+    self.stats = make_stats(self.args.profile)
+    self.recorder = make_recorder(self.args)
     # observation
-    self.obv = deque([], maxlen=self.args.total_frame)
+    self.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
     self.to_state_fn = get_to_state_fn[self.args.obv_type]
     # observation space
     self.observation_space = get_obs_space(self.args)
@@ -30,12 +41,56 @@ class ThegameEnvV1(SinglePlayerEnv):
     else:
       self.action_space = spaces.Discrete(self.args.shoot_disc)
 
+  def step_async(self, action):
+    """
+    issue `action` and step in a background thread,
+    return a future of the step result so that many envs can be waited
+    together, e.g. by `concurrent.futures.wait` or `asyncio.wrap_future`
+    """
+    if self.pending is not None:
+      raise RuntimeError('step_async is called before step_wait')
+    self.pending = self.executor.submit(self.run_step, action)
+    return self.pending
+
+  def run_step(self, action):
+    """
+    SinglePlayerEnv step with stats and recording,
+    the controls, tick and fetch phase is timed until the observation is drawn
+    """
+    self.stats.start()
+    obv, reward, done, info = super().step(action)
+    if self.recorder is not None:
+      self.recorder.record(action, self.batch, self.obv.last(), reward, done)
+    stats = self.stats.stop()
+    if stats is not None:
+      info = {**info, 'stats': stats}
+    return obv, reward, done, info
+
+  def step_wait(self):
+    """
+    obv, reward, done, info = step_wait()
+    """
+    pending, self.pending = self.pending, None
+    return pending.result()
+
+  def step(self, action):
+    self.step_async(action)
+    return self.step_wait()
+
   def reset(self):
+    if self.pending is not None:
+      self.pending.exception()
+      self.pending = None
+    self.stats.start()
     self.step_num = 0
     self.server.reset()
     self.server.tick()
     self.game_state = self.client.fetch_state()
-    return self.game_state_to_observation(self.game_state, reset=True)
+    obv = self.game_state_to_observation(self.game_state, reset=True)
+    if self.recorder is not None:
+      self.recorder.record(None, self.batch, self.obv.last(), 0, False, True)
+    self.stats.stop('reset')
+    return obv
 
   def action_to_controls(self, action):
     shoot_dir, acc_dir, ability_type = convert_to_radians(action, self.args)
@@ -47,44 +102,41 @@ class ThegameEnvV1(SinglePlayerEnv):
         shoot_direction=shoot_dir,
     )
 
+  def entity_batch(self, gs: GameState):
+    """
+    columnar entities of `gs`, built once per game state
+    """
+    if gs is not self.batch_state:
+      self.batch = EntityBatch.from_state(
+          (gs.hero, gs.heroes, gs.polygons, gs.bullets))
+      self.batch_state = gs
+    return self.batch
+
   def game_state_to_observation(self, gs: GameState, reset=False):
-    game_state = gs.hero, gs.heroes, gs.polygons, gs.bullets
-    obv, self.img = self.to_state_fn(game_state, self.args)
-    if reset:
-      for _ in range(self.args.total_frame):
-        self.obv.append(obv)
-      return LazyFrames([obv] * self.args.stack_frame)
+    self.stats.lap('tick')
+    batch = self.entity_batch(gs)
+    self.stats.lap('batch')
+    obv = self.to_state_fn(batch, self.args)
+    self.stats.lap('render')
+    self.stats.count('entities', len(batch))
     # update frame buffer
-    self.obv.append(obv)
-    obv = [
-        self.obv[i]
-        for i in range(0, self.args.total_frame, self.args.skip_frame)
-    ]
-    return LazyFrames(obv)
+    if reset:
+      self.obv.reset(obv)
+    else:
+      self.obv.append(obv)
+    obv = self.obv.copy()
+    self.stats.lap('stack')
+    return obv
 
   def get_reward(self, prev, curr):
-    def reward_scaling(enemy_cur, enemy_prev):
-      health, max_health, exp = enemy_cur
-      health_prev, _, _ = enemy_prev
-      if health >= health_prev:
-        return 0
-      discount_factor = (health_prev -
-                         health) / max_health * (1.5 - health / max_health)
-      return exp * discount_factor / 2
-
-    enemies = {}
-    reward = 0
-    for e in [*curr.heroes, *curr.polygons]:
-      enemies[e.id] = (e.health, e.max_health, e.rewarding_experience)
-    for e_id in enemies.keys() & self.prev_enemies.keys():
-      reward += reward_scaling(enemies[e_id], self.prev_enemies[e_id])
-    self.prev_enemies = enemies
+    reward = self.rewards.update(self.entity_batch(curr))
     reward += (curr.hero.score - prev.hero.score) / 2
+    self.stats.lap('reward')
 
     return np.clip(reward / 40, -10, 10)
 
   def render(self, mode='human'):
-    img = self.img
+    img = state_to_img(self.batch, self.args)
     if mode == 'rgb_array':
       return img
     elif mode == 'human':
@@ -94,3 +146,19 @@ class ThegameEnvV1(SinglePlayerEnv):
       self.viewer.imshow(img)
       return self.viewer.isopen
     logger.warn('mode `{}` is not supported'.format(mode))
+
+  def get_stats(self):
+    """
+    aggregate step and reset stats, empty if Profile is disabled
+    """
+    return self.stats.summary()
+
+  def close(self):
+    if self.viewer:
+      self.viewer.close()
+    self.executor.shutdown()
+    self.pending = None
+    if self.recorder is not None:
+      self.recorder.close()
+      self.recorder = None
+    super().close()
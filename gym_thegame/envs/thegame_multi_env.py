@@ -0,0 +1,213 @@
+from gym_thegame.envs.server import Server
+from gym_thegame.envs.client import Client
+from gym_thegame.envs.channel import StateChannel
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_states_fn, get_frame_shape,
+                                    convert_to_radians)
+from gym import spaces
+import copy
+import multiprocessing
+import numpy as np
+
+
+class ThegameMultiEnv:
+  """
+  `num_agents` Client heroes playing in one thegame server
+  every server sync advances all heroes together,
+  observations, rewards and dones have one row per hero
+  """
+  def __init__(self, num_agents, port=None):
+    self.args = parse_args()
+    if port is not None:
+      self.args.port = port
+    self.num_agents = num_agents
+    self.server, self.clients, self.channels = None, [], []
+    self.batches = [None] * num_agents
+    self.stats = make_stats(self.args.profile)
+    # observation
+    self.obv = [
+        FrameStack(self.args.stack_frame, self.args.skip_frame)
+        for _ in range(num_agents)
+    ]
+    # frames of all heroes are drawn in one batched call per step
+    self.to_states_fn = get_to_states_fn[self.args.obv_type]
+    # observation space
+    self.observation_space = get_obs_space(self.args)
+    # action space of every hero
+    if self.args.acc_disc:
+      self.action_space = spaces.MultiDiscrete(
+          [self.args.shoot_disc, self.args.acc_disc + 1])
+    else:
+      self.action_space = spaces.Discrete(self.args.shoot_disc)
+
+  def step(self, actions=None, move_to=None):
+    """
+    actions, move_to: one entry per hero
+    obvs, rewards, dones, infos = step(actions, move_to)
+    """
+    self.stats.start()
+    if actions is None:
+      actions = [None] * self.num_agents
+    if move_to is None:
+      move_to = [None] * self.num_agents
+    actions = [convert_to_radians(action, self.args) for action in actions]
+    states = self.tick(actions, move_to, render=self.args.client_render)
+
+    rewards = np.empty(self.num_agents)
+    for i, (batch, reward) in enumerate(states):
+      self.batches[i] = batch
+      rewards[i] = reward
+      self.stats.count('entities', len(batch))
+    if self.args.client_render:
+      # rendered by the clients into shared memory
+      frames = [channel.frame for channel in self.channels]
+    else:
+      frames = self.to_states_fn(self.batches, self.args)
+    # the first frame after reset fills the whole stack
+    for obv, frame in zip(self.obv, frames):
+      obv.append(frame)
+    self.stats.lap('render')
+    obvs = self.stacked_obvs()
+    self.stats.lap('stack')
+
+    # update environment timestep and check episode end
+    if all(target is None for target in move_to):
+      self.counter += 1
+    dones = np.full(self.num_agents, self.counter >= self.args.total_steps)
+    infos = [{} for _ in range(self.num_agents)]
+    stats = self.stats.stop()
+    if stats is not None:
+      infos[0]['stats'] = stats
+    return obvs, np.clip(rewards / 40, -10, 10), dones, infos
+
+  def stacked_obvs(self):
+    """
+    stacked observations of all heroes in one array
+    """
+    view = self.obv[0].view()
+    obvs = np.empty((self.num_agents, *view.shape), dtype=view.dtype)
+    for i, obv in enumerate(self.obv):
+      obv.copy(out=obvs[i])
+    return obvs
+
+  def tick(self, actions, move_to, ticks=1, render=False):
+    """
+    advance the game by `ticks` server ticks for all heroes,
+    return [(entity batch, reward)] of the last tick, one per hero
+    """
+    for channel, action, target in zip(self.channels, actions, move_to):
+      channel.send_actions(action, target, ticks, render)
+    self.server.sync(ticks)
+    self.stats.lap('sync')
+    self.stats.count('ticks', ticks)
+    states = [channel.wait_state(self.alive) for channel in self.channels]
+    self.stats.lap('wait')
+    return states
+
+  def alive(self):
+    """
+    check if thegame server and all clients are running
+    """
+    return (self.server is not None and self.server.alive()
+            and all(client.is_alive() for client in self.clients))
+
+  def start(self):
+    """
+    (re)start thegame server and clients, return once all clients are playing
+    """
+    self.terminate()
+
+    # create thegame server
+    self.server = Server(self.args.server_bin, self.args.port)
+    self.server.start()
+    self.server.wait_ready()
+
+    # create thegame clients, each hero with its own name
+    for i in range(self.num_agents):
+      args = copy.copy(self.args)
+      args.name = '{}{}'.format(self.args.name, i)
+      if self.args.client_render:
+        channel = StateChannel(frame_shape=get_frame_shape(self.args),
+                               frame_dtype=self.args.obv_dtype)
+      else:
+        channel = StateChannel()
+      client = multiprocessing.Process(target=Client.main,
+                                       args=(
+                                           'localhost:{}'.format(
+                                               self.args.port),
+                                           args,
+                                           channel,
+                                       ))
+      client.start()
+      self.channels.append(channel)
+      self.clients.append(client)
+    for channel, client in zip(self.channels, self.clients):
+      channel.wait_ready(client.is_alive)
+
+    # tick until every client is connected and receives its first state,
+    # connected clients keep playing in lockstep meanwhile
+    playing = [False] * self.num_agents
+    while not all(playing):
+      if not self.alive():
+        raise RuntimeError('thegame exited before all clients were playing')
+      for channel, ready in zip(self.channels, playing):
+        if ready:
+          channel.send_actions(None)
+      self.server.sync()
+      for i, channel in enumerate(self.channels):
+        if playing[i]:
+          channel.recv_state()
+        else:
+          playing[i] = channel.recv_state(timeout=1) is not None
+
+  def terminate(self):
+    """
+    terminate server and clients if exist
+    """
+    for client in self.clients:
+      client.terminate()
+      client.join()
+    if self.server:
+      self.server.terminate()
+    self.server, self.clients, self.channels = None, [], []
+
+  def reset(self):
+    self.stats.start()
+    # with KeepAlive server and clients are kept across episodes,
+    # restart only if died, the server has no command to reset its arena
+    if not (self.args.keep_alive and self.alive()):
+      self.start()
+      self.stats.lap('start')
+      self.stats.count('restarts')
+    for obv in self.obv:
+      obv.clear()
+
+    # random init, every hero walks to its own position
+    self.counter = 0
+    targets = [
+        tuple(target)
+        for target in (np.random.random_sample([self.num_agents, 2]) * 3000 +
+                       500).tolist()
+    ]
+    # only the last walking frames are kept in the frame buffer
+    walk = 301 - self.args.total_frame
+    while walk > 0:
+      ticks = min(walk, self.args.warm_start_batch)
+      self.tick([None] * self.num_agents, targets, ticks=ticks)
+      walk -= ticks
+    for _ in range(min(301, self.args.total_frame) - 1):
+      self.step(move_to=targets)
+
+    obvs = self.step(move_to=targets)[0]
+    self.stats.stop('reset')
+    return obvs
+
+  def get_stats(self):
+    """
+    aggregate step and reset stats, empty if Profile is disabled
+    """
+    return self.stats.summary()
+
+  def close(self):
+    self.terminate()
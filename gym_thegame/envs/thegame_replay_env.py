@@ -0,0 +1,157 @@
+from gym_thegame.envs.entity import EntityBatch
+from gym_thegame.envs.recorder import Trajectory
+from gym_thegame.envs.reward import RewardTracker
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_state_fn, state_to_img)
+import gym
+from gym import logger, spaces
+import numpy as np
+
+
+def as_batch(state):
+  """
+  entity batch of a game state tuple (hero, heroes, polygons, bullets),
+  a `GameState` of thegame gymbase or an `EntityBatch`
+  """
+  if isinstance(state, EntityBatch):
+    return state
+  if hasattr(state, 'hero'):
+    state = state.hero, state.heroes, state.polygons, state.bullets
+  return EntityBatch.from_state(state)
+
+
+class ThegameReplayEnv(gym.Env):
+  """
+  replay recorded game states without thegame server
+  states are drawn by the configured renderer, stacked and rewarded,
+  actions are ignored
+  states: recorder directory, `Trajectory` or a sequence of game states
+  reward_fn: reward_fn(batch) -> reward, rescaled like the live envs,
+    by default the recorded rewards of a `Trajectory` are replayed as is,
+    other states fall back to `RewardTracker`, reset at every episode,
+    which rewards polygon damage only, without the score of ThegameEnv,
+    and needs distinct entity ids, ThegameTrainEnv states all have id 0
+  an episode starts from a stack filled with its first recorded state,
+  ThegameEnv does not record the walking states before it
+  """
+  metadata = {'render.modes': ['human', 'rgb_array']}
+
+  def __init__(self, states, reward_fn=None):
+    self.args = parse_args()
+    self.viewer = None
+    if isinstance(states, str):
+      states = Trajectory(states)
+    self.states = states
+    if isinstance(states, Trajectory):
+      self.episode_starts = np.flatnonzero(states.resets())
+      self.get_batch = states.batch
+    else:
+      self.episode_starts = np.zeros(1, dtype=np.int64)
+      self.get_batch = lambda t: as_batch(states[t])
+    if not len(self.episode_starts):
+      self.episode_starts = np.zeros(1, dtype=np.int64)
+    self.rewards = RewardTracker()
+    self.recorded = reward_fn is None and isinstance(states, Trajectory)
+    self.reward_fn = reward_fn or self.rewards.update
+    self.t, self.end = -1, 0
+    self.batch = None
+    # observation
+    self.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
+    self.to_state_fn = get_to_state_fn[self.args.obv_type]
+    # observation space
+    self.observation_space = get_obs_space(self.args)
+    # action space
+    if self.args.acc_disc:
+      self.action_space = spaces.MultiDiscrete(
+          [self.args.shoot_disc, self.args.acc_disc + 1])
+    else:
+      self.action_space = spaces.Discrete(self.args.shoot_disc)
+
+  def __len__(self):
+    return len(self.states)
+
+  def reset(self):
+    """
+    start the next recorded episode, wrap around after the last one
+    """
+    k = np.searchsorted(self.episode_starts, self.t, side='right')
+    if k == len(self.episode_starts):
+      k = 0
+    self.t = int(self.episode_starts[k])
+    self.end = (int(self.episode_starts[k + 1])
+                if k + 1 < len(self.episode_starts) else len(self.states))
+
+    self.batch = self.get_batch(self.t)
+    self.rewards.reset()
+    if not self.recorded:
+      self.reward_fn(self.batch)
+    self.obv.reset(self.to_state_fn(self.batch, self.args))
+    return self.obv.copy()
+
+  def step(self, action=None):
+    """
+    obv, reward, done, info = step()
+    the episode is done at the last state before the next recorded reset
+    """
+    reward, done = self.advance()
+    return self.obv.copy(), reward, done, {}
+
+  def advance(self):
+    """
+    draw and stack the next state, return (reward, done)
+    """
+    if self.t + 1 >= self.end:
+      raise RuntimeError('episode is done, call reset')
+    self.t += 1
+    self.batch = self.get_batch(self.t)
+    if self.recorded:
+      reward = float(self.states.record(self.t)['reward'])
+    else:
+      reward = np.clip(self.reward_fn(self.batch) / 40, -10, 10)
+    self.obv.append(self.to_state_fn(self.batch, self.args))
+    return reward, self.t + 1 >= self.end
+
+  def batches(self, batch_size):
+    """
+    replay every episode once,
+    yield (obvs, rewards, dones) of up to `batch_size` consecutive states,
+    the first state of an episode has reward 0
+    """
+    obvs = np.empty((batch_size, *self.observation_space.shape),
+                    self.observation_space.dtype)
+    rewards, dones = np.zeros(batch_size), np.zeros(batch_size, dtype=bool)
+    n = 0
+    self.t = -1
+    for _ in range(len(self.episode_starts)):
+      self.reset()
+      rewards[n], dones[n] = 0, self.t + 1 >= self.end
+      self.obv.copy(out=obvs[n])
+      n += 1
+      while not dones[n - 1]:
+        if n == batch_size:
+          yield obvs.copy(), rewards.copy(), dones.copy()
+          n = 0
+        rewards[n], dones[n] = self.advance()
+        self.obv.copy(out=obvs[n])
+        n += 1
+      if n == batch_size:
+        yield obvs.copy(), rewards.copy(), dones.copy()
+        n = 0
+    if n:
+      yield obvs[:n].copy(), rewards[:n].copy(), dones[:n].copy()
+
+  def render(self, mode='human'):
+    img = state_to_img(self.batch, self.args)
+    if mode == 'rgb_array':
+      return img
+    elif mode == 'human':
+      from gym.envs.classic_control import rendering
+      if self.viewer is None:
+        self.viewer = rendering.SimpleImageViewer()
+      self.viewer.imshow(img)
+      return self.viewer.isopen
+    logger.warn('mode `{}` is not supported'.format(mode))
+
+  def close(self):
+    if self.viewer:
+      self.viewer.close()
@@ -1,10 +1,14 @@
-from gym_thegame.envs.utils import (LazyFrames, parse_args, get_obs_space,
-                                    get_to_state_fn, convert_to_radians)
+from gym_thegame.envs.entity import EntityBatch
+from gym_thegame.envs.recorder import make_recorder
+from gym_thegame.envs.scenario import make_scenarios
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_state_fn, state_to_img,
+                                    convert_to_radians)
 import gym
 from gym import logger, spaces
-from collections import deque
+import copy
 import math
-import random
 import numpy as np
 
 
@@ -33,6 +37,95 @@ class Obj:
     self.duration = 120  # for bullet
     self.move = move  # for bullet
 
+  @property
+  def velocity(self):
+    return self.move
+
+
+class Grid:
+  """
+  uniform grid broad phase over static objects
+  objects are bucketed by the cell containing their center
+  """
+  def __init__(self, objs, cell_size=50):
+    self.cell_size = cell_size
+    # largest object radius, any collision is within this reach
+    self.reach = max((obj.radius for obj in objs), default=0)
+    self.cells = {}
+    for order, obj in enumerate(objs):
+      cell = self.cells.setdefault(self.cell(*obj.position), {})
+      cell[id(obj)] = order, obj
+
+  def cell(self, x, y):
+    return int(x // self.cell_size), int(y // self.cell_size)
+
+  def query(self, obj):
+    """
+    objects which may collide with `obj`, in insertion order
+    """
+    x, y = obj.position
+    r = max(self.reach, obj.radius)
+    (lx, ly), (rx, ry) = self.cell(x - r, y - r), self.cell(x + r, y + r)
+    found = []
+    for cx in range(lx, rx + 1):
+      for cy in range(ly, ry + 1):
+        if (cx, cy) in self.cells:
+          found.extend(self.cells[cx, cy].values())
+    return [obj for _, obj in sorted(found, key=lambda entry: entry[0])]
+
+  def remove(self, obj):
+    cell = self.cell(*obj.position)
+    del self.cells[cell][id(obj)]
+    if not self.cells[cell]:
+      del self.cells[cell]
+
+
+# compact record of an `Obj`
+OBJ_DTYPE = np.dtype([
+    ('position', np.float64, (2, )),
+    ('radius', np.float64),
+    ('health', np.float64),
+    ('max_health', np.float64),
+    ('edges', np.int64),
+    ('body_damage', np.float64),
+    ('reward', np.float64),
+    ('cooldown', np.int64),
+    ('duration', np.int64),
+    ('move', np.float64, (2, )),
+])
+
+
+def objs_to_records(objs):
+  return np.array([(o.position, o.radius, o.health, o.max_health, o.edges,
+                    o.body_damage, o.rewarding_experience, o.cooldown,
+                    o.duration, o.move) for o in objs],
+                  dtype=OBJ_DTYPE)
+
+
+def records_to_objs(records):
+  objs = []
+  for (position, radius, health, max_health, edges, body_damage, reward,
+       cooldown, duration, move) in zip(
+           *(records[name].tolist() for name in OBJ_DTYPE.names)):
+    obj = Obj(position=tuple(position),
+              radius=radius,
+              health=health,
+              max_health=max_health,
+              edge=edges,
+              body_damage=body_damage,
+              reward=reward,
+              move=tuple(move))
+    obj.cooldown, obj.duration = cooldown, duration
+    objs.append(obj)
+  return objs
+
+
+# polygon attributes by edges
+EDGE_RADIUS = {3: 20, 4: 20, 5: 25}
+EDGE_BODY_DAMAGE = {3: 10, 4: 20, 5: 40}
+EDGE_REWARD = {3: 10, 4: 60, 5: 360}
+EDGE_HEALTH = {3: 100, 4: 300, 5: 1000}
+
 
 class ThegameTrainEnv(gym.Env):
   metadata = {'render.modes': ['human', 'rgb_array']}
@@ -41,16 +134,14 @@ class ThegameTrainEnv(gym.Env):
     self.args = parse_args()
     self.viewer = None
     ### training environment ###
-    self.reset_counter = 0
+    self.scenarios = make_scenarios(self.args)
     self.env_state = None, [], [], []
-    # reset jump angle: (counter * multiply) % gen_directions
-    for m in range(self.args.poly_gen_dirs // 4, self.args.poly_gen_dirs):
-      if math.gcd(m, self.args.poly_gen_dirs) == 1:
-        self.multiply = m
-        break
+    self.poly_grid = Grid([])
+    self.stats = make_stats(self.args.profile)
+    self.recorder = make_recorder(self.args)
 
     ### training agent ###
-    self.obv = deque([], maxlen=self.args.total_frame)
+    self.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
     self.to_state_fn = get_to_state_fn[self.args.obv_type]
     # observation space
     self.observation_space = get_obs_space(self.args)
@@ -63,11 +154,17 @@ class ThegameTrainEnv(gym.Env):
     else:
       self.action_space = spaces.Discrete(self.args.shoot_disc)
 
+  def seed(self, seed=None):
+    self.scenarios.close()
+    self.scenarios = make_scenarios(self.args, seed)
+    return [seed]
+
   def step(self, action):
     """
     env step function
     obv, reward, done, info = step(action)
     """
+    self.stats.start()
     if self.args.shoot_disc == -1:
       shoot_dir = action * math.pi
     else:
@@ -101,38 +198,47 @@ class ThegameTrainEnv(gym.Env):
       hero.cooldown = self.args.cool_down
     else:
       hero.cooldown -= 1
+    self.stats.lap('shoot')
 
     ### handle bullet shot target ###
     reward = 0
+    killed = False
+    bullets = [b for b in bullets if b.duration > 0 and b.health > 0]
     for b in bullets:
-      if b.duration == 0 or b.health <= 0:
-        bullets.remove(b)
-      else:
-        b.duration -= 1
-        x, y = b.position
-        dx, dy = b.move
-        b.position = x + dx, y + dy
-        for p in polygons:
-          if collide(p, b):
-            p.health -= b.body_damage
-            b.health -= p.body_damage
-            if p.health <= 0:
-              polygons.remove(p)
-              reward += p.rewarding_experience / 2
-            else:
-              reward += p.rewarding_experience * b.body_damage / p.max_health * (
-                  1.5 - p.health / p.max_health) / 2
+      b.duration -= 1
+      x, y = b.position
+      dx, dy = b.move
+      b.position = x + dx, y + dy
+      candidates = self.poly_grid.query(b)
+      self.stats.count('candidates', len(candidates))
+      for p in candidates:
+        if p.health > 0 and collide(p, b):
+          p.health -= b.body_damage
+          b.health -= p.body_damage
+          if p.health <= 0:
+            self.poly_grid.remove(p)
+            killed = True
+            self.stats.count('kills')
+            reward += p.rewarding_experience / 2
+          else:
+            reward += p.rewarding_experience * b.body_damage / p.max_health * (
+                1.5 - p.health / p.max_health) / 2
+    if killed:
+      polygons = [p for p in polygons if p.health > 0]
+    self.stats.lap('collide')
+    self.stats.count('bullets', len(bullets))
 
     # save env internal state
     self.env_state = hero, heros, polygons, bullets
-    obv, self.img = self.to_state_fn(self.env_state, self.args)
+    self.batch = EntityBatch.from_state(self.env_state)
+    self.stats.lap('batch')
+    obv = self.to_state_fn(self.batch, self.args)
+    self.stats.lap('render')
 
     # create stacked frames
     self.obv.append(obv)
-    obv = [
-        self.obv[i]
-        for i in range(0, self.args.total_frame, self.args.skip_frame)
-    ]
+    obv = self.obv.copy()
+    self.stats.lap('stack')
 
     ### handle game episode end ###
     if self.args.total_steps == -1:
@@ -150,91 +256,108 @@ class ThegameTrainEnv(gym.Env):
       if reward != 0:
         print('timestep', self.counter, 'reward', reward)
 
-    return LazyFrames(obv), np.clip(reward / 40, -10, 10), done, {}
-    #return np.concatenate(obv, axis=-1), np.clip(reward / 40, -10, 10), done, {}
+    reward = np.clip(reward / 40, -10, 10)
+    if self.recorder is not None:
+      self.recorder.record(action, self.batch, self.obv.last(), reward, done)
+    info = {}
+    stats = self.stats.stop()
+    if stats is not None:
+      info['stats'] = stats
+    return obv, reward, done, info
 
   def reset(self):
     """
     environment reset
 
-    1. generate polygons
+    1. take the next scenario
     2. initialize internal states
     3. return initial stack frames
     """
-    # random init hero position
-    hx, hy = random.randint(300, 4700), random.randint(300, 3700)
-    polys = []
-    thetas = []
-
-    ### polygons generating directions ###
-    # poly_gen_dirs: all possible generating directions number
-    # poly_dirs:     number of directions polygons be genrated per episode
-    if self.args.poly_gen_dirs == -1:
-      # uniform random
-      for _ in range(self.args.poly_dirs):
-        thetas.append(random.uniform(0, 2 * math.pi))
-    else:
-      # first direction = (counter * multiply) % poly_gen_dirs
-      theta = (int(self.reset_counter * self.multiply) %
-               self.args.poly_gen_dirs) / self.args.poly_gen_dirs * 2 * math.pi
-      self.reset_counter += 1
-      thetas.append(theta)
-
-      # uniform random for lefting poly_dirs
-      for _ in range(1, self.args.poly_dirs):
-        thetas.append(
-            random.randint(0, self.args.poly_gen_dirs - 1) /
-            self.args.poly_gen_dirs * 2 * math.pi)
-
-    # generate polygons using polygons generating directions
-    total_reward = 0
-    for theta in thetas:
-      for i in range(self.args.poly_gen_num):
-        if i < self.args.poly_shootable_num:
-          # must shootable for poly_gen_range >= 120
-          dtheta = random.uniform(-1, 1) * 2 * math.pi / 120 / 2
-        else:
-          dtheta = random.uniform(
-              -1, 1) * 2 * math.pi / self.args.poly_gen_range / 2
-        R = random.uniform(100, 800)
-        e = random.randint(3, 5)  # edge
-        e2r = {3: 20, 4: 20, 5: 25}  # radius
-        e2bd = {3: 10, 4: 20, 5: 40}  # body_damage
-        e2re = {3: 10, 4: 60, 5: 360}  # reward
-        e2h = {3: 100, 4: 300, 5: 1000}  # health
-        total_reward += e2re[e]
-        # position = ( R * cos(theta), R * sing(theta) )
-        dx, dy = math.cos(theta + dtheta) * R, math.sin(theta + dtheta) * R
-        if 0 < hx + dx < 5000 and 0 < hy + dy < 4000:
-          polys.append(
-              Obj(position=(hx + dx, hy + dy),
-                  radius=e2r[e],
-                  edge=e,
-                  health=e2h[e],
-                  max_health=e2h[e],
-                  body_damage=e2bd[e],
-                  reward=e2re[e]))
-
-    print(f'reset with hero position ({hx}, {hy})')
-    print(f'reward {total_reward / 40} for killing all polygons')
-    print(f'thetas {thetas} for generating polygons')
+    self.stats.start()
+    hero_position, _, positions, edges = self.scenarios.next()
+    polys = [
+        Obj(position=tuple(position),
+            radius=EDGE_RADIUS[e],
+            edge=e,
+            health=EDGE_HEALTH[e],
+            max_health=EDGE_HEALTH[e],
+            body_damage=EDGE_BODY_DAMAGE[e],
+            reward=EDGE_REWARD[e])
+        for position, e in zip(positions.tolist(), edges.tolist())
+    ]
 
     # initial hero and env internal state
-    hero = Obj(position=(hx, hy), radius=30)
+    hero = Obj(position=tuple(hero_position.tolist()), radius=30)
     heros = []
     polygons = polys
     bullets = []
+    self.poly_grid = Grid(polygons)
     self.env_state = hero, heros, polygons, bullets
-    obv, self.img = self.to_state_fn(self.env_state, self.args)
+    self.stats.lap('generate')
+    self.batch = EntityBatch.from_state(self.env_state)
+    self.stats.lap('batch')
+    obv = self.to_state_fn(self.batch, self.args)
+    self.stats.lap('render')
     self.counter = 0
 
-    for _ in range(self.args.total_frame):
-      self.obv.append(obv)
+    self.obv.reset(obv)
+    obv = self.obv.copy()
+    self.stats.lap('stack')
+    if self.recorder is not None:
+      self.recorder.record(None, self.batch, self.obv.last(), 0, False, True)
+    self.stats.stop('reset')
+    return obv
+
+  def get_stats(self):
+    """
+    aggregate step and reset stats, empty if Profile is disabled
+    """
+    return self.stats.summary()
+
+  def get_state(self):
+    """
+    snapshot of the world, counters, scenario source and frame buffer
+    objects are kept in `OBJ_DTYPE` records: [hero, *polygons, *bullets]
+    """
+    hero, _, polygons, bullets = self.env_state
+    return {
+        'objs': objs_to_records((hero, *polygons, *bullets)),
+        'n_polygons': len(polygons),
+        'counter': self.counter,
+        'scenarios': self.scenarios.get_state(),
+        'obv': self.obv.get_state(),
+    }
+
+  def set_state(self, state):
+    """
+    restore a snapshot of `get_state`, the snapshot can be restored again
+    """
+    hero, *objs = records_to_objs(state['objs'])
+    polygons = objs[:state['n_polygons']]
+    bullets = objs[state['n_polygons']:]
+    self.env_state = hero, [], polygons, bullets
+    self.poly_grid = Grid(polygons)
+    self.batch = EntityBatch.from_state(self.env_state)
+    self.counter = state['counter']
+    self.scenarios.set_state(state['scenarios'])
+    self.obv.set_state(state['obv'])
 
-    return LazyFrames([obv] * self.args.stack_frame)
+  def clone(self):
+    """
+    independent copy of the environment in the same state
+    the copy does not record, its steps would interleave with this one
+    """
+    env = copy.copy(self)
+    env.viewer = None
+    env.recorder = None
+    env.scenarios = self.scenarios.clone()
+    env.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
+    env.stats = make_stats(self.args.profile)
+    env.set_state(self.get_state())
+    return env
 
   def render(self, mode='human'):
-    img = self.img
+    img = state_to_img(self.batch, self.args)
     if mode == 'rgb_array':
       return img
     elif mode == 'human':
@@ -244,3 +367,11 @@ class ThegameTrainEnv(gym.Env):
       self.viewer.imshow(img)
       return self.viewer.isopen
     logger.warn('mode `{}` is not supported'.format(mode))
+
+  def close(self):
+    if self.viewer:
+      self.viewer.close()
+    self.scenarios.close()
+    if self.recorder is not None:
+      self.recorder.close()
+      self.recorder = None
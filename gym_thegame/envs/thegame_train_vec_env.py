@@ -0,0 +1,301 @@
+from gym_thegame.envs.entity import EntityBatches
+from gym_thegame.envs.stats import make_stats
+from gym_thegame.envs.scenario import make_scenarios
+from gym_thegame.envs.thegame_train_env import (EDGE_RADIUS, EDGE_BODY_DAMAGE,
+                                                EDGE_REWARD, EDGE_HEALTH)
+from gym_thegame.envs.utils import (FrameStack, parse_args, get_obs_space,
+                                    get_to_states_fn)
+from gym import spaces
+import math
+import numpy as np
+
+
+def edge_array(attrs):
+  """
+  polygon attributes indexed by edges
+  """
+  array = np.zeros(max(attrs) + 1)
+  array[list(attrs)] = list(attrs.values())
+  return array
+
+
+EDGE_RADIUS_ARRAY = edge_array(EDGE_RADIUS)
+EDGE_BODY_DAMAGE_ARRAY = edge_array(EDGE_BODY_DAMAGE)
+EDGE_REWARD_ARRAY = edge_array(EDGE_REWARD)
+EDGE_HEALTH_ARRAY = edge_array(EDGE_HEALTH)
+
+
+class ThegameTrainVecEnv:
+  """
+  `num_envs` ThegameTrainEnv worlds simulated together
+  world state is kept in arrays of shape (num_envs, ...),
+  finished worlds are reset automatically
+  """
+  # hero and bullet attributes
+  HeroRadius = 30
+  BulletRadius, BulletHealth, BulletBodyDamage = 10, 40, 12
+  BulletDuration = 120
+
+  def __init__(self, num_envs):
+    self.args = parse_args()
+    self.num_envs = num_envs
+    ### training environment ###
+    # fixed scenarios: world `i` starts from the `i`-th one
+    self.scenarios = [
+        make_scenarios(self.args, None, i) for i in range(num_envs)
+    ]
+
+    # hero: position, shooting cooldown and episode timestep
+    self.hero_position = np.zeros((num_envs, 2))
+    self.cooldown = np.zeros(num_envs, dtype=np.int64)
+    self.counter = np.zeros(num_envs, dtype=np.int64)
+    # polygons: padded to the most polygons a world can generate
+    n = self.scenarios[0].max_polygons()
+    self.poly_alive = np.zeros((num_envs, n), dtype=bool)
+    self.poly_position = np.zeros((num_envs, n, 2))
+    self.poly_edges = np.zeros((num_envs, n), dtype=np.int64)
+    self.poly_radius = np.zeros((num_envs, n))
+    self.poly_health = np.zeros((num_envs, n))
+    self.poly_max_health = np.ones((num_envs, n))
+    self.poly_body_damage = np.zeros((num_envs, n))
+    self.poly_reward = np.zeros((num_envs, n))
+    # bullets: one shot every (cool_down + 1) steps lives for at most
+    # (duration + 1) steps, so shots are stored in a ring of slots
+    n = (self.BulletDuration + 1) // (self.args.cool_down + 1) + 1
+    self.shots = np.zeros(num_envs, dtype=np.int64)
+    self.bullet_alive = np.zeros((num_envs, n), dtype=bool)
+    self.bullet_order = np.zeros((num_envs, n), dtype=np.int64)
+    self.bullet_position = np.zeros((num_envs, n, 2))
+    self.bullet_move = np.zeros((num_envs, n, 2))
+    self.bullet_health = np.zeros((num_envs, n))
+    self.bullet_duration = np.zeros((num_envs, n), dtype=np.int64)
+
+    ### training agent ###
+    # frames of all worlds are stacked along their first axis
+    self.obv = FrameStack(self.args.stack_frame, self.args.skip_frame)
+    # frames of all worlds are drawn in one batched call per step
+    self.to_states_fn = get_to_states_fn[self.args.obv_type]
+    self.actions = None
+    self.stats = make_stats(self.args.profile)
+    # observation space
+    self.observation_space = get_obs_space(self.args)
+    # action space
+    if self.args.shoot_disc == -1:
+      self.action_space = spaces.Box(shape=(1, ),
+                                     low=-1,
+                                     high=1,
+                                     dtype=np.float32)
+    else:
+      self.action_space = spaces.Discrete(self.args.shoot_disc)
+
+  def seed(self, seed=None):
+    """
+    seed world `i` with `seed + i`
+    """
+    seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+    for scenarios in self.scenarios:
+      scenarios.close()
+    self.scenarios = [
+        make_scenarios(self.args, s, i) for i, s in enumerate(seeds)
+    ]
+    return seeds
+
+  def reset(self):
+    """
+    reset all worlds and return initial stacked observations
+    """
+    self.stats.start()
+    for i in range(self.num_envs):
+      self.reset_world(i)
+    self.obv.reset(self.render())
+    obvs = self.obv.copy()
+    self.stats.lap('stack')
+    self.stats.stop('reset')
+    return obvs
+
+  def reset_world(self, i):
+    """
+    reset world `i`, its frame stack is refilled by the caller
+    """
+    position, _, positions, edges = self.scenarios[i].next()
+    self.stats.count('resets')
+
+    # initial hero and env internal state
+    self.hero_position[i] = position
+    self.cooldown[i] = 0
+    self.counter[i] = 0
+    n = len(edges)
+    self.poly_alive[i] = np.arange(self.poly_alive.shape[1]) < n
+    self.poly_position[i, :n] = positions
+    self.poly_edges[i, :n] = edges
+    self.poly_radius[i, :n] = EDGE_RADIUS_ARRAY[edges]
+    self.poly_health[i, :n] = EDGE_HEALTH_ARRAY[edges]
+    self.poly_max_health[i, :n] = self.poly_health[i, :n]
+    self.poly_body_damage[i, :n] = EDGE_BODY_DAMAGE_ARRAY[edges]
+    self.poly_reward[i, :n] = EDGE_REWARD_ARRAY[edges]
+    self.shots[i] = 0
+    self.bullet_alive[i] = False
+    self.stats.lap('generate')
+
+  def render(self):
+    """
+    draw the frames of all worlds in one batched call
+    """
+    batches = self.entity_batches()
+    self.stats.lap('batch')
+    frames = self.to_states_fn(batches, self.args)
+    self.stats.lap('render')
+    return frames
+
+  def entity_batches(self):
+    """
+    columnar entities of all worlds, bullets in shooting order
+    """
+    w_poly, polys = np.nonzero(self.poly_alive)
+    w_bullet, slots = np.nonzero(self.bullet_alive)
+    order = np.lexsort((self.bullet_order[w_bullet, slots], w_bullet))
+    w_bullet, slots = w_bullet[order], slots[order]
+    counts = np.zeros((self.num_envs, 4), dtype=np.int64)
+    counts[:, 0] = 1
+    counts[:, 2] = np.bincount(w_poly, minlength=self.num_envs)
+    counts[:, 3] = np.bincount(w_bullet, minlength=self.num_envs)
+    batches = EntityBatches.from_counts(counts)
+    hero, poly, bullet = (batches.role == 0, batches.role == 2,
+                          batches.role == 3)
+
+    # hero and bullets take the default attributes of `Obj`,
+    # id and owner are 0 and entities are static except bullets
+    batches.position[hero] = self.hero_position
+    batches.position[poly] = self.poly_position[w_poly, polys]
+    batches.position[bullet] = self.bullet_position[w_bullet, slots]
+    batches.radius[hero] = self.HeroRadius
+    batches.radius[poly] = self.poly_radius[w_poly, polys]
+    batches.radius[bullet] = self.BulletRadius
+    batches.health[hero] = 1000
+    batches.health[poly] = self.poly_health[w_poly, polys]
+    batches.health[bullet] = self.bullet_health[w_bullet, slots]
+    batches.max_health[hero] = 1000
+    batches.max_health[poly] = self.poly_max_health[w_poly, polys]
+    batches.max_health[bullet] = self.BulletHealth
+    batches.edges[:] = 4
+    batches.edges[poly] = self.poly_edges[w_poly, polys]
+    batches.body_damage[hero] = 40
+    batches.body_damage[poly] = self.poly_body_damage[w_poly, polys]
+    batches.body_damage[bullet] = self.BulletBodyDamage
+    batches.reward[:] = 360
+    batches.reward[poly] = self.poly_reward[w_poly, polys]
+    batches.velocity[bullet] = self.bullet_move[w_bullet, slots]
+    return batches
+
+  def step_async(self, actions):
+    self.actions = actions
+
+  def step_wait(self):
+    """
+    advance every world by one step
+    obvs, rewards, dones, infos = step_wait()
+    stats of the whole batched step are in infos[0]['stats']
+    """
+    self.stats.start()
+    actions = np.asarray(self.actions, dtype=np.float64).reshape(-1)
+    if self.args.shoot_disc == -1:
+      shoot_dir = actions * math.pi
+    else:
+      shoot_dir = actions / self.args.shoot_disc * 2 * math.pi
+
+    ### handle shooting bullet ###
+    (shoot, ) = np.nonzero(self.cooldown == 0)
+    slot = self.shots[shoot] % self.bullet_alive.shape[1]
+    self.bullet_alive[shoot, slot] = True
+    self.bullet_order[shoot, slot] = self.shots[shoot]
+    self.bullet_position[shoot, slot] = self.hero_position[shoot]
+    self.bullet_move[shoot, slot, 0] = (self.args.bullet_speed *
+                                        np.cos(shoot_dir[shoot]))
+    self.bullet_move[shoot, slot, 1] = (self.args.bullet_speed *
+                                        np.sin(shoot_dir[shoot]))
+    self.bullet_health[shoot, slot] = self.BulletHealth
+    self.bullet_duration[shoot, slot] = self.BulletDuration
+    self.shots[shoot] += 1
+    self.cooldown -= 1
+    self.cooldown[shoot] = self.args.cool_down
+    self.stats.lap('shoot')
+
+    ### handle bullet shot target ###
+    alive = self.bullet_alive & (self.bullet_duration > 0) & (
+        self.bullet_health > 0)
+    self.bullet_alive = alive
+    self.bullet_duration -= alive
+    self.bullet_position += self.bullet_move * alive[:, :, None]
+
+    # bullet and polygon contacts: (world, polygon, bullet)
+    delta = self.poly_position[:, :, None] - self.bullet_position[:, None]
+    radius = np.maximum(self.poly_radius, self.BulletRadius)[:, :, None]
+    hit = (delta[..., 0]**2 + delta[..., 1]**2 <= radius**2) & (
+        self.poly_alive[:, :, None] & alive[:, None])
+    w, p, b = np.nonzero(hit)
+    # bullets hit a polygon one after another in shooting order
+    order = np.lexsort((self.bullet_order[w, b], p, w))
+    w, p, b = w[order], p[order], b[order]
+    damage = np.full(len(w), self.BulletBodyDamage, dtype=np.float64)
+    first = np.ones(len(w), dtype=bool)
+    first[1:] = (w[1:] != w[:-1]) | (p[1:] != p[:-1])
+    start = np.maximum.accumulate(np.where(first, np.arange(len(w)), 0))
+    dealt = np.cumsum(damage)
+    dealt -= dealt[start] - damage[start]
+    # polygon health before and after every contact
+    health = self.poly_health[w, p] - dealt + damage
+    valid = health > 0
+    w, p, b, damage = w[valid], p[valid], b[valid], damage[valid]
+    health = health[valid] - damage
+    max_health, exp = self.poly_max_health[w, p], self.poly_reward[w, p]
+    reward = np.where(
+        health <= 0, exp / 2,
+        exp * damage / max_health * (1.5 - health / max_health) / 2)
+    np.subtract.at(self.poly_health, (w, p), damage)
+    np.subtract.at(self.bullet_health, (w, b), self.poly_body_damage[w, p])
+    self.poly_alive &= self.poly_health > 0
+    reward = np.bincount(w, weights=reward, minlength=self.num_envs)
+    self.stats.lap('collide')
+    self.stats.count('contacts', len(w))
+
+    ### handle game episode end ###
+    if self.args.total_steps == -1:
+      # game end if shot
+      done = reward > 0
+      reward = np.where(done, 40, -20)
+    else:
+      # game end if reach total game steps
+      self.counter += 1
+      done = self.counter >= self.args.total_steps
+
+    # reset finished worlds, their frame stacks are refilled
+    for i in np.flatnonzero(done):
+      self.reset_world(i)
+    frames = self.render()
+    self.obv.append(frames)
+    if done.any():
+      self.obv.refill(done, frames[done])
+    obvs = self.obv.copy()
+    self.stats.lap('stack')
+    infos = [{} for _ in range(self.num_envs)]
+    stats = self.stats.stop()
+    if stats is not None:
+      infos[0]['stats'] = stats
+    return obvs, np.clip(reward / 40, -10, 10), done, infos
+
+  def step(self, actions):
+    """
+    obvs, rewards, dones, infos = step(actions)
+    """
+    self.step_async(actions)
+    return self.step_wait()
+
+  def get_stats(self):
+    """
+    aggregate step and reset stats, empty if Profile is disabled
+    """
+    return self.stats.summary()
+
+  def close(self):
+    for scenarios in self.scenarios:
+      scenarios.close()
@@ -0,0 +1,114 @@
+from gym_thegame.envs.server import free_ports
+from gym_thegame.envs.thegame_env import ThegameEnv
+from gym_thegame.envs.utils import parse_args, get_obs_space
+from gym import spaces
+import multiprocessing
+import numpy as np
+
+
+def worker(remote, parent_remote, index, port, obvs, obv_shape, obv_dtype):
+  """
+  run a ThegameEnv on `port`, write observations into `obvs[index]`
+  and reply with (reward, done, info) records only
+  """
+  parent_remote.close()
+  obv = np.frombuffer(obvs, dtype=obv_dtype).reshape(obv_shape)[index]
+  env = ThegameEnv(port=port)
+  try:
+    while True:
+      cmd, data = remote.recv()
+      if cmd == 'step':
+        ob, reward, done, info = env.step(data)
+        if done:
+          ob = env.reset()
+        obv[...] = ob
+        remote.send((reward, done, info))
+      elif cmd == 'reset':
+        obv[...] = env.reset()
+        remote.send(None)
+      elif cmd == 'stats':
+        remote.send(env.get_stats())
+      elif cmd == 'close':
+        break
+  finally:
+    env.close()
+    remote.close()
+
+
+class ThegameVecEnv:
+  """
+  `num_envs` server-backed ThegameEnv in worker processes
+  each worker runs its own thegame server on a free port,
+  observations are shared through one (num_envs, ...) shared-memory array,
+  finished environments are reset automatically
+  """
+  def __init__(self, num_envs):
+    self.args = parse_args()
+    self.num_envs = num_envs
+    self.observation_space = get_obs_space(self.args)
+    if self.args.acc_disc:
+      self.action_space = spaces.MultiDiscrete(
+          [self.args.shoot_disc, self.args.acc_disc + 1])
+    else:
+      self.action_space = spaces.Discrete(self.args.shoot_disc)
+    # shared observation batch
+    obv_shape = (num_envs, *self.observation_space.shape)
+    obv_dtype = self.args.obv_dtype
+    self.shared_obvs = multiprocessing.RawArray(
+        'B', int(np.prod(obv_shape)) * obv_dtype.itemsize)
+    self.obvs = np.frombuffer(self.shared_obvs,
+                              dtype=obv_dtype).reshape(obv_shape)
+
+    self.remotes, work_remotes = zip(
+        *[multiprocessing.Pipe() for _ in range(num_envs)])
+    self.procs = [
+        # not daemonic, every ThegameEnv starts its own client process
+        multiprocessing.Process(target=worker,
+                                args=(work_remote, remote, index, port,
+                                      self.shared_obvs, obv_shape, obv_dtype))
+        for index, (work_remote, remote, port) in enumerate(
+            zip(work_remotes, self.remotes, free_ports(num_envs)))
+    ]
+    for proc, work_remote in zip(self.procs, work_remotes):
+      proc.start()
+      work_remote.close()
+    self.closed = False
+
+  def reset(self):
+    for remote in self.remotes:
+      remote.send(('reset', None))
+    for remote in self.remotes:
+      remote.recv()
+    return self.obvs.copy()
+
+  def step_async(self, actions):
+    for remote, action in zip(self.remotes, actions):
+      remote.send(('step', action))
+
+  def step_wait(self):
+    """
+    obvs, rewards, dones, infos = step_wait()
+    """
+    rewards, dones, infos = zip(*[remote.recv() for remote in self.remotes])
+    return self.obvs.copy(), np.array(rewards), np.array(dones), list(infos)
+
+  def step(self, actions):
+    self.step_async(actions)
+    return self.step_wait()
+
+  def get_stats(self):
+    """
+    aggregate stats of every worker env
+    """
+    for remote in self.remotes:
+      remote.send(('stats', None))
+    return [remote.recv() for remote in self.remotes]
+
+  def close(self):
+    if self.closed:
+      return
+    for remote in self.remotes:
+      remote.send(('close', None))
+    for proc in self.procs:
+      proc.join()
+    self.closed = True
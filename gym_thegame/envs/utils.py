@@ -1,4 +1,5 @@
-from baselines.common.atari_wrappers import LazyFrames
+from gym_thegame.envs.entity import EntityBatches
+from gym_thegame.envs.render import paint, project, quantize_radius
 from gym import spaces
 import math
 import numpy as np
@@ -14,6 +15,18 @@ def parse_args(filename='thegame.cfg'):
   PolyGenRange: polygons generate range divider. 8 means 2pi / 8
   PolyGenNum: polygons generate number
   PolyShootableNum: polygons generate number of must shootable
+  WarmStartBatch: server ticks per round trip in the reset walk
+  ObvDtype: observation dtype, float64, float32 or uint8 (0 ~ 255)
+  ClientRender: render observations in the client process (ThegameEnv)
+  KeepAlive: keep thegame server and client across episodes (ThegameEnv),
+    restart them only if died, 0 restarts them on every reset,
+    kept episodes continue the running arena: polygons, other heroes and
+    the hero's level are not reset, the hero only walks to a new position
+  Profile: per-phase step timers and counters in info['stats']
+  ScenarioPool: scenarios pre-generated by a background thread, 0 if off
+  ScenarioFile: fixed scenarios file saved by `save_scenarios`
+  RecordDir: record trajectories into a new run directory under it
+  NearestEntities: entities observed besides the hero by entities ObvType
   """
   import configparser
 
@@ -38,7 +51,13 @@ def parse_args(filename='thegame.cfg'):
       'poly_dirs': ('PolyDirs', 1),
       'poly_gen_range': ('PolyGenRange', 5),
       'poly_gen_num': ('PolyGenNum', 15),
-      'poly_shootable_num': ('PolyShootableNum', 7)
+      'poly_shootable_num': ('PolyShootableNum', 7),
+      'warm_start_batch': ('WarmStartBatch', 1),
+      'client_render': ('ClientRender', 0),
+      'keep_alive': ('KeepAlive', 0),
+      'profile': ('Profile', 0),
+      'scenario_pool': ('ScenarioPool', 0),
+      'nearest_entities': ('NearestEntities', 16),
   }
   # parse cfg
   config = configparser.ConfigParser()
@@ -50,6 +69,12 @@ def parse_args(filename='thegame.cfg'):
   if 'Environment' in config:
     cfg = config['Environment']
   args.obv_type = cfg.get('ObvType', 'gray')
+  args.obv_dtype = np.dtype(cfg.get('ObvDtype', 'float64'))
+  args.scenario_file = cfg.get('ScenarioFile', '')
+  args.record_dir = cfg.get('RecordDir', '')
+  if args.obv_type in ('layer', 'entities') and args.obv_dtype == np.uint8:
+    raise ValueError('ObvDtype uint8 is not supported by {} ObvType'.format(
+        args.obv_type))
   for k, v in env_args.items():
     setattr(args, k, cfg.getint(*v))
   # postprocessing
@@ -59,14 +84,126 @@ def parse_args(filename='thegame.cfg'):
   return args
 
 
+def get_frame_shape(args):
+  """
+  shape of a single observation frame
+  """
+  if args.obv_type == 'entities':
+    return args.nearest_entities + 1, ENTITY_FEATURES
+  return args.width, args.height, 1 if args.obv_type == 'gray' else 3
+
+
 def get_obs_space(args):
+  high = 255 if args.obv_dtype == np.uint8 else 1
+  if args.obv_type == 'entities':
+    return spaces.Box(shape=(args.nearest_entities + 1,
+                             ENTITY_FEATURES * args.stack_frame),
+                      low=-1,
+                      high=1,
+                      dtype=args.obv_dtype)
   if args.obv_type == 'gray':
     return spaces.Box(shape=(args.width, args.height, args.stack_frame),
                       low=0,
-                      high=1)
-    return spaces.Box(shape=(args.width, args.height, 3 * args.stack_frame),
-                      low=-1,
-                      high=1)
+                      high=high,
+                      dtype=args.obv_dtype)
+  return spaces.Box(shape=(args.width, args.height, 3 * args.stack_frame),
+                    low=-high if args.obv_type == 'layer' else 0,
+                    high=high,
+                    dtype=args.obv_dtype)
+
+
+class FrameStack:
+  """
+  ring buffer of stacked frames
+  the observation at step t stacks frames
+    t - total_frame + 1, t - total_frame + skip_frame + 1, ..., t - skip_frame + 1
+  so frames are kept in one ring per step residue mod skip_frame,
+  every ring stores its frames twice so a stack is a contiguous slice
+  """
+  def __init__(self, stack_frame, skip_frame):
+    self.stack, self.skip = stack_frame, skip_frame
+    self.buffer = None
+    self.filled = False
+    self.t = 0
+
+  def reset(self, frame):
+    """
+    fill the whole stack with `frame`
+    """
+    if self.buffer is None:
+      *shape, self.channel = frame.shape
+      self.buffer = np.empty(
+          (self.skip, *shape, 2 * self.stack * self.channel), frame.dtype)
+    self.buffer[...] = np.concatenate([frame] * 2 * self.stack, axis=-1)
+    self.filled = True
+    self.t = 0
+
+  def refill(self, index, frame):
+    """
+    fill the stacks at `index` of the first frame axis with `frame`,
+    e.g. the reset worlds of a frame stack batched over worlds
+    """
+    self.buffer[:, index] = np.concatenate([frame] * 2 * self.stack, axis=-1)
+
+  def clear(self):
+    """
+    the next appended frame fills the whole stack
+    """
+    self.filled = False
+
+  def append(self, frame):
+    if not self.filled:
+      return self.reset(frame)
+    self.t += 1
+    ring = self.buffer[self.t % self.skip]
+    slot = (self.t // self.skip) % self.stack * self.channel
+    ring[..., slot:slot + self.channel] = frame
+    slot += self.stack * self.channel
+    ring[..., slot:slot + self.channel] = frame
+
+  def last(self):
+    """
+    the last appended frame as a view into the ring buffer
+    """
+    ring = self.buffer[self.t % self.skip]
+    slot = (self.t // self.skip) % self.stack * self.channel
+    return ring[..., slot:slot + self.channel]
+
+  def view(self):
+    """
+    stacked observation as a view into the ring buffer,
+    it is overwritten by following appends
+    """
+    newest = (self.t + 1) // self.skip - 1
+    slot = (newest + 1) % self.stack * self.channel
+    ring = self.buffer[(self.t + 1) % self.skip]
+    return ring[..., slot:slot + self.stack * self.channel]
+
+  def copy(self, out=None):
+    """
+    stacked observation copied into `out` or a new array
+    """
+    if out is None:
+      return self.view().copy()
+    out[...] = self.view()
+    return out
+
+  def get_state(self):
+    """
+    copy of the ring buffer and position, restored by `set_state`
+    """
+    buffer = None if self.buffer is None else self.buffer.copy()
+    return buffer, self.t, self.filled
+
+  def set_state(self, state):
+    buffer, self.t, self.filled = state
+    if buffer is None:
+      self.buffer = None
+    elif self.buffer is None or self.buffer.shape != buffer.shape:
+      self.buffer = buffer.copy()
+      self.channel = buffer.shape[-1] // (2 * self.stack)
+    else:
+      self.buffer[...] = buffer
 
 
 def convert_to_radians(action, args):
@@ -89,11 +226,11 @@ def convert_to_radians(action, args):
   return shoot_dir, acc_dir, ability_type
 
 
-def draw_boundary(hero, state, args):
+def draw_boundary(hero_position, state, args):
   """
   fill area out of arena boundary with boundary_color
   """
-  hx, hy = hero.position
+  hx, hy = hero_position
   hx, hy = hx / args.quantize, hy / args.quantize
   x_max, y_max = 5000 / args.quantize, 4000 / args.quantize
   up_bound = int(max(0, args.height / 2 - hy))
@@ -107,107 +244,180 @@ def draw_boundary(hero, state, args):
   return state
 
 
-def state_to_layer(game_state, args):
+def draw_boundaries(hero_position, state, args):
+  """
+  fill area out of arena boundary with boundary_color
+  for a batch of states (n, width, height, channels)
+  and their hero positions (n, 2),
+  the areas are rectangles so filling them as slices is cheap
+  """
+  for position, s in zip(hero_position.tolist(), state):
+    draw_boundary(position, s, args)
+  return state
+
+
+def states_to_layer(batches, args, out=None):
   """
-  draw information into channels
+  draw information of entity `batches`, a list of `EntityBatch` or
+  `EntityBatches`, into channels of `out` or a new
+  array (n, width, height, 3)
   state channel define:
     0: total body damage (+alley, -enemy), boundary with
     1: entity health (include self)
     2: reward exp (+alley, -enemy)
   """
-  hero, heroes, polygons, bullets = game_state
-
-  # channel info type and rescale function
-  channel_info = {
-      'body_damage': (0, lambda v: v / 60),
-      'health': (1, lambda v: v / 3000),
-      'reward': (2, lambda v: v / 1000),
-  }
+  batches = EntityBatches.of(batches)
+  hero = batches.first[batches.world]
+  x, y = project(batches.position, batches.position[hero], args)
+  radius = quantize_radius(batches.radius, args)
+  role = batches.role
+  is_self = (role == 3) & (batches.owner == batches.id[hero])
 
-  def draw(state, obj, value, channel_type):
+  def draw(state, idx, values, channel, rescale):
     """
-    draw `obj` relative to current hero position
-    using rescaled channel info value
+    draw entities `idx` relative to current hero position
+    using rescaled channel values
     """
-    channel, rescale = channel_info[channel_type]
-    value = np.clip(rescale(value), -1, 1)
-    hx, hy = hero.position
-    x, y = obj.position
-    x, y, hx, hy = x / args.quantize, y / args.quantize, hx / args.quantize, hy / args.quantize
-    radius_quantize = {0.5: 0, 1: 1, 1.25: 2, 1.5: 2}
-    if obj.radius / args.quantize in radius_quantize:
-      radius = radius_quantize[obj.radius / args.quantize]
-    else:
-      radius = math.ceil(obj.radius / args.quantize)
-    x = round(x + args.width / 2 - hx)
-    y = round(y + args.height / 2 - hy)
-    lx, rx = int(max(0, x - radius)), int(min(args.width, x + radius + 1))
-    ly, ry = int(max(0, y - radius)), int(min(args.height, y + radius + 1))
-    for i in range(lx, rx):
-      for j in range(ly, ry):
-        if (i - x)**2 + (j - y)**2 <= radius**2:
-          state[j, i, channel] = value
+    values = np.clip(rescale(values[idx]), -1, 1)
+    paint(state[..., channel:channel + 1], x[idx], y[idx], radius[idx],
+          values[:, None], args, batches.world[idx])
 
   # draw for every entity
-  state = np.zeros((args.width, args.height, 3), dtype=np.float)
+  if out is None:
+    out = np.zeros((len(batches), args.width, args.height, 3),
+                   dtype=args.obv_dtype)
+  else:
+    out[...] = 0
 
-  enemy_bullets = [b for b in bullets if b.owner_id != hero.id]
-  self_bullets = [b for b in bullets if b.owner_id == hero.id]
-  for entity in [hero, *self_bullets]:
-    draw(state, entity, entity.body_damage, 'body_damage')
-  for entity in [*heroes, *polygons, *enemy_bullets]:
-    draw(state, entity, -entity.body_damage, 'body_damage')
-  for entity in [hero, *heroes, *polygons, *bullets]:
-    draw(state, entity, entity.health, 'health')
-  for entity in [*heroes, *polygons]:
-    draw(state, entity, entity.rewarding_experience, 'reward')
-  draw(state, hero, -entity.rewarding_experience, 'reward')
+  # hero, own bullets, heroes, polygons, other bullets within every state
+  rank = np.array([0, 2, 3, 4])[role]
+  rank[is_self] = 1
+  sign = np.where(rank < 2, 1, -1)
+  idx = np.lexsort((rank, batches.world))
+  draw(out, idx, sign * batches.body_damage, 0, lambda v: v / 60)
 
-  state = draw_boundary(hero, state, args)
-  return state, np.array(state * 255, dtype=np.uint8)
+  draw(out, np.arange(len(role)), batches.health, 1, lambda v: v / 3000)
 
+  # hero is drawn with the negated reward of the last entity drawn before,
+  # or of the last entity without enemies
+  n_enemies = batches.n_heroes + batches.n_polygons
+  last = batches.first + np.where(n_enemies, n_enemies, batches.n_bullets)
+  reward = batches.reward.copy()
+  reward[batches.first] = -batches.reward[last]
+  # heroes, polygons, hero
+  idx = np.lexsort((np.array([2, 0, 1, 3])[role], batches.world))
+  idx = idx[role[idx] != 3]
+  draw(out, idx, reward, 2, lambda v: v / 1000)
 
-def state_to_rgb(game_state, args):
+  return draw_boundaries(batches.position[batches.first], out, args)
+
+
+def state_to_layer(batch, args):
   """
-  draw state with rgb or gray obv type
+  draw information into channels, see `states_to_layer`
   """
-  hero, heroes, polygons, bullets = game_state
+  return states_to_layer([batch], args)[0]
 
-  def interp(color_range, ratio):
-    return (int(end - (end - start) * ratio)
-            for start, end in zip(*color_range))
 
-  def draw(state, obj, color_range):
-    """
-    draw `obj` relative to current hero position
-    using color_range interpolated by current health
-    """
-    color = interp(color_range, obj.health / obj.max_health)
-    hx, hy = hero.position
-    x, y = obj.position
-    x, y, hx, hy = x / args.quantize, y / args.quantize, hx / args.quantize, hy / args.quantize
-
-    # radius adjustment
-    radius_quantize = {0.5: 0, 1: 1, 1.25: 2, 1.5: 2}
-    if obj.radius / args.quantize in radius_quantize:
-      radius = radius_quantize[obj.radius / args.quantize]
-    else:
-      radius = math.ceil(obj.radius / args.quantize)
-
-    # drawing range calculate
-    x = round(x + args.width / 2 - hx)
-    y = round(y + args.height / 2 - hy)
-    lx, rx = int(max(0, x - radius)), int(min(args.width, x + radius + 1))
-    ly, ry = int(max(0, y - radius)), int(min(args.height, y + radius + 1))
-    # drawing value
-    for channel, value in enumerate(color):
-      for i in range(lx, rx):
-        for j in range(ly, ry):
-          if (i - x)**2 + (j - y)**2 <= radius**2:
-            state[j, i, channel] = value
-
-  if args.obv_type == 'rgb':
-    bg_color = 255
+# columns of an entities observation row
+ENTITY_FEATURES = 12
+
+
+def states_to_entities(batches, args, out=None):
+  """
+  describe the hero and its nearest visible entities without drawing
+  for entity `batches` into `out` or a new array
+  (n, nearest_entities + 1, ENTITY_FEATURES),
+  one row per entity, nearest first and ties in entity order,
+  padded with zero rows
+  entity columns define:
+    0: 1 for entities, 0 for padding
+    1-2: position relative to hero / half view size,
+         arena position / arena size for the hero
+    3-4: velocity / 30
+    5: health ratio
+    6: body damage / 60
+    7-11: one-hot kind, hero, other heroes, polygons, own bullets,
+          other bullets
+  """
+  batches = EntityBatches.of(batches)
+  k = args.nearest_entities
+  if out is None:
+    out = np.zeros((len(batches), k + 1, ENTITY_FEATURES),
+                   dtype=args.obv_dtype)
+  else:
+    out[...] = 0
+
+  hero = batches.first[batches.world]
+  kind = batches.role.copy()
+  kind[(kind == 3) & (batches.owner != batches.id[hero])] = 4
+
+  # k nearest entities in the view of every state
+  half = np.array([args.width, args.height]) / 2 * args.quantize
+  offset = batches.position - batches.position[hero]
+  (visible, ) = np.nonzero((batches.role != 0)
+                           & np.all(np.abs(offset) <= half, axis=1))
+  distance = np.einsum('ij,ij->i', offset[visible], offset[visible])
+  visible = visible[np.lexsort((distance, batches.world[visible]))]
+  world = batches.world[visible]
+  rank = np.arange(len(visible)) - np.searchsorted(world, world)
+  visible, world, rank = visible[rank < k], world[rank < k], rank[rank < k]
+
+  # hero rows then entity rows
+  heroes = np.arange(len(batches))
+  out[heroes, 0, 1:3] = batches.position[batches.first] / (5000, 4000)
+  out[world, rank + 1, 1:3] = offset[visible] / half
+  world = np.concatenate([heroes, world])
+  row = np.concatenate([np.zeros_like(heroes), rank + 1])
+  idx = np.concatenate([batches.first, visible])
+  out[world, row, 0] = 1
+  out[world, row, 3:5] = np.clip(batches.velocity[idx] / 30, -1, 1)
+  out[world, row, 5] = batches.health[idx] / batches.max_health[idx]
+  out[world, row, 6] = np.clip(batches.body_damage[idx] / 60, 0, 1)
+  out[world, row, 7 + kind[idx]] = 1
+  return out
+
+
+def state_to_entities(batch, args):
+  """
+  describe the hero and its nearest visible entities without drawing,
+  see `states_to_entities`
+  """
+  return states_to_entities([batch], args)[0]
+
+
+def to_uint8(img, out=None):
+  """
+  clip colors of an int16 image to uint8
+  """
+  if out is None:
+    out = np.empty(img.shape, dtype=np.uint8)
+  return np.clip(img, 0, 255, out=out, casting='unsafe')
+
+
+def to_obv(img, args, out=None):
+  """
+  convert int16 image to observation dtype, rescaled to 0 ~ 1 if float,
+  clipped to 0 ~ 255 if uint8
+  """
+  if args.obv_dtype == np.uint8:
+    return to_uint8(img, out)
+  return np.divide(img, 255, out=out, dtype=args.obv_dtype)
+
+
+# cached color palettes: gray -> color ranges of every entity kind
+_palettes = {}
+
+
+def color_palette(gray):
+  """
+  color ranges (start, end) of hero, other, polygon 3, 4, 5 as an int64
+  array (5, 2, 3) for the gray or rgb obv type
+  """
+  palette = _palettes.get(gray)
+  if palette is not None:
+    return palette
+  if not gray:
     #
     # color range: (start rgb, end rgb)
     #
@@ -222,7 +432,6 @@ def state_to_rgb(game_state, args):
     # heroes, other bullets: red
     other_color = ((114, 11, 11), (239, 103, 103))
   else:  # gray obv
-    bg_color = args.bg_color
     hero_color = ((255, 255, 255), (50, 50, 50))
     polygon_color = {
         3: ((130, 130, 130), (0, 0, 0)),
@@ -230,34 +439,113 @@ def state_to_rgb(game_state, args):
         5: ((200, 200, 200), (0, 0, 0)),
     }
     other_color = ((180, 180, 180), (0, 0, 0))
+  palette = _palettes[gray] = np.array(
+      [hero_color, other_color, *(polygon_color[e] for e in (3, 4, 5))],
+      dtype=np.int64)
+  return palette
 
-  # draw for every entity
-  state = np.full((args.width, args.height, 3), bg_color, dtype=np.float)
-  for polygon in polygons:
-    draw(state, polygon, polygon_color[polygon.edges])
-  for bullet in bullets:
-    if bullet.owner_id == hero.id:
-      draw(state, bullet, hero_color)
-    else:
-      draw(state, bullet, other_color)
-  for hero_ in heroes:
-    draw(state, hero_, other_color)
-  draw(state, hero, hero_color)
 
-  state = draw_boundary(hero, state, args)
-  return state / 255, np.array(state, dtype=np.uint8)
+def draw_colors_batch(batches, args, channels):
+  """
+  draw entities of `EntityBatches` with colors interpolated by health
+  into int16 images (n, width, height, channels),
+  colors of entities with health out of 0 ~ max_health can leave 0 ~ 255,
+  only palette `channels` are drawn
+  """
+  gray = args.obv_type == 'gray'
+  bg_color = args.bg_color if gray else 255
+  palette = color_palette(gray)[..., channels]
+
+  # drawing order and color range of every entity,
+  # polygons, bullets, heroes, hero within every state
+  hero = batches.first[batches.world]
+  role = batches.role
+  idx = np.lexsort((np.array([3, 2, 0, 1])[role], batches.world))
+  kind = np.array([0, 1, 0, 0])[role]
+  polygons, bullets = role == 2, role == 3
+  kind[polygons] = batches.edges[polygons] - 1
+  kind[bullets] = batches.owner[bullets] != batches.id[hero[bullets]]
+  kind = kind[idx]
+  # color interpolated by current health
+  ratio = batches.health[idx] / batches.max_health[idx]
+  start, end = palette[kind, 0], palette[kind, 1]
+  color = np.clip(end - (end - start) * ratio[:, None], -2**15,
+                  2**15 - 1).astype(np.int16)
 
+  # draw for every entity relative to current hero position
+  state = np.full((len(batches), args.width, args.height, palette.shape[-1]),
+                  bg_color,
+                  dtype=np.int16)
+  x, y = project(batches.position[idx], batches.position[hero[idx]], args)
+  radius = quantize_radius(batches.radius[idx], args)
+  paint(state, x, y, radius, color, args, batches.world[idx])
 
-def state_to_gray(game_state, args):
+  return draw_boundaries(batches.position[batches.first], state, args)
+
+
+def draw_colors(batch, args, channels):
   """
-  draw state to gray obv
+  draw entities with colors interpolated by health into an uint8 image,
+  only palette `channels` are drawn
   """
-  state_rgb, img = state_to_rgb(game_state, args)
-  return state_rgb[:, :, 2:], img
+  return to_uint8(draw_colors_batch(EntityBatches([batch]), args, channels)[0])
+
+
+def states_to_rgb(batches, args, out=None):
+  """
+  draw entity `batches` with rgb obv type into `out` or a new array
+  """
+  img = draw_colors_batch(EntityBatches.of(batches), args, slice(0, 3))
+  return to_obv(img, args, out)
+
+
+def states_to_gray(batches, args, out=None):
+  """
+  draw entity `batches` to gray obv into `out` or a new array,
+  gray palette channels are all the same so only the last channel is drawn
+  """
+  img = draw_colors_batch(EntityBatches.of(batches), args, slice(2, 3))
+  return to_obv(img, args, out)
+
+
+def state_to_rgb(batch, args):
+  """
+  draw state with rgb obv type
+  """
+  return states_to_rgb([batch], args)[0]
+
+
+def state_to_gray(batch, args):
+  """
+  draw state to gray obv, gray palette channels are all the same
+  so only the last channel is drawn
+  """
+  return states_to_gray([batch], args)[0]
+
+
+def state_to_img(batch, args):
+  """
+  draw uint8 rgb image of the state for display,
+  only drawn when rendering is requested
+  """
+  if args.obv_type == 'layer':
+    return np.array(state_to_layer(batch, args) * 255, dtype=np.uint8)
+  return draw_colors(batch, args, slice(0, 3))
 
 
 get_to_state_fn = {
     'rgb': state_to_rgb,
     'layer': state_to_layer,
-    'gray': state_to_gray
+    'gray': state_to_gray,
+    'entities': state_to_entities,
 }
+
+# batched renderers, fn(batches, args, out=None) draws a list of
+# entity batches or `EntityBatches` into an array (n, *frame shape)
+get_to_states_fn = {
+    'rgb': states_to_rgb,
+    'layer': states_to_layer,
+    'gray': states_to_gray,
+    'entities': states_to_entities,
+}
+